@@ -1,108 +1,288 @@
+import asyncio
+import logging
 import os
 from langchain_openai import AzureChatOpenAI
-from langgraph.prebuilt import ToolNode
+from contextlib import asynccontextmanager
 from datetime import datetime
+from functools import lru_cache
 from typing import Annotated
 from typing_extensions import TypedDict
 from langgraph.graph.message import AnyMessage, add_messages
-from langchain_core.prompts import ChatPromptTemplate
 from langgraph.checkpoint.memory import MemorySaver
 from langgraph.graph import END, StateGraph, START
 from langgraph.prebuilt import tools_condition
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage, message_chunk_to_message
 from dotenv import load_dotenv
-from ai_backend.agent_tools import (lookup_faq, get_daily_park_data, handle_resignation, handle_lost_backstagepass,
-                                    handle_illness_insurance, handle_give_away_shift, handle_work_certificate_request)
+from ai_backend.local_embeddings import OnnxEmbeddings
+from ai_backend.planner import Planner
+from ai_backend.router import CANNED_ANSWERS, route_condition, route_message
+from ai_backend.semantic_cache import SemanticCache
+from ai_backend.agent_tools import (EMBEDDING_NAMESPACE, embedding_batcher, lookup_faq, get_daily_park_data, handle_resignation,
+                                    handle_lost_backstagepass, handle_illness_insurance, handle_give_away_shift,
+                                    handle_work_certificate_request)
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 azure_openai_api_version: str = "2023-05-15"
 azure_deployment = "gpt-4o-mini"
 
 llm = AzureChatOpenAI(
     azure_deployment=azure_deployment,
     temperature=0.2,
-    max_tokens=4000,
+    max_tokens=800,
     api_version=os.getenv("AZURE_OPENAI_API_VERSION"),
     model="gpt-4o-mini"
 )
 
+tools = [lookup_faq, get_daily_park_data, handle_resignation, handle_lost_backstagepass, handle_illness_insurance,
+         handle_give_away_shift, handle_work_certificate_request]
+TOOL_NAMES = ", ".join(tool.name for tool in tools)
+
+# The LLM occasionally returns an empty message, it is retried a few times before giving up.
+MAX_LLM_ATTEMPTS = 3
+FALLBACK_ANSWER = "Tyvärr kunde jag inte ta fram ett svar just nu. Vänligen kontakta Artistservice för hjälp med frågan."
+
 
 class State(TypedDict):
     messages: Annotated[list[AnyMessage], add_messages]
     sources: list[str]
     original_contents: list[str]
+    # Artifact of the latest lookup_faq call, with the sources and contents that are shown with the answer.
+    lookup_faq_artifact: dict
     park: str
     employmentType: str
 
 
+def _current_turn(messages):
+    """Returns the latest user message and the messages that has been added after it."""
+    turn = []
+    for message in reversed(messages):
+        if isinstance(message, HumanMessage):
+            return message, turn
+        turn.append(message)
+    return None, turn
+
+
+def _is_first_question(messages) -> bool:
+    """True if no earlier message reached the assistant, greetings and thanks answered by the router don't count."""
+    question, turn = _current_turn(messages)
+    earlier = messages[:len(messages) - len(turn) - 1] if question is not None else messages
+    return all(isinstance(message, HumanMessage)
+               or (isinstance(message, AIMessage) and not message.tool_calls and message.content in CANNED_ANSWERS)
+               for message in earlier)
+
 
 class Assistant:
-    def __init__(self, runnable):
+    def __init__(self, runnable, embed, embedding_namespace, cache_path=":memory:"):
         self.runnable = runnable
+        self.embed = embed
+        self.cache = SemanticCache(cache_path, embedding_namespace)
 
-    def __call__(self, state, config):
+    async def __call__(self, state, config):
         configuration = config.get("configurable", {})
         state["park"] = configuration.get("park", None)
         state["employmentType"] = configuration.get("employmentType", None)
-        state["current_date"] = configuration.get("current_date", "")
-        state["current_time"] = configuration.get("current_time", "")
-        state["tools"] = ", ".join(["lookup_faq", "get_daily_park_data", "handle_resignation",
-                                    "handle_lost_backstagepass", "handle_illness_insurance", "handle_give_away_shift",
-                                    "handle_work_certificate_request"])
-
-        while True:
-            result = self.runnable.invoke(state)
-            if not result.tool_calls and not result.content:
-                state["messages"].append(("user", "Respond with a real output."))
-            else:
+
+        system_message = render_system(state["park"], state["employmentType"],
+                                       configuration.get("current_date", ""), configuration.get("current_time", ""),
+                                       TOOL_NAMES)
+        messages = [system_message] + state["messages"]
+
+        for attempt in range(MAX_LLM_ATTEMPTS):
+            if attempt:
+                await asyncio.sleep(0.2 * 2 ** (attempt - 1))
+            result = await self._stream(messages, config)
+            if result.tool_calls or result.content:
                 break
+            logger.warning("The LLM returned an empty message on attempt %d of %d.", attempt + 1, MAX_LLM_ATTEMPTS)
+            messages.append(HumanMessage(content="Respond with a real output."))
+        else:
+            return {"messages": AIMessage(content=FALLBACK_ANSWER)}
 
+        await self._cache_faq_answer(state, result)
         return {"messages": result}
 
+    async def answer_from_cache(self, state, config):
+        """
+        Graph node that answers repeated questions from the semantic cache, without calling the LLM. It runs before
+        the planner and the assistant, so a cache hit skips the planned tool calls as well. Only the first question of
+        a conversation is looked up, later messages like "Ja" can depend on the earlier turns.
+        """
+        message = state["messages"][-1]
+        if not isinstance(message, HumanMessage) or not _is_first_question(state["messages"]):
+            return {"messages": []}
+        configuration = config.get("configurable", {})
+        cached = await self._cached_answer(message.content, configuration.get("park"),
+                                           configuration.get("employmentType"))
+        if cached is None:
+            return {"messages": []}
+        cached_answer, artifact = cached
+        return {"messages": [AIMessage(content=cached_answer)], "lookup_faq_artifact": artifact}
 
-def create_primary_prompt():
-    return ChatPromptTemplate.from_messages([
-        ("system", """
-        Du är en hjälpsam och vänlig AI-assistent för medarbetare på {park}. Dagens datum är {current_date}. Och klockan är {current_time}.
-        Den medarbetare som du hjälper är har anställningsformen {employmentType}, vilket är viktigt att du tar hänsyn 
-        till. Använd de verktyg som du har tillgång till, så som {tools} för att hjälpa medarbetaren.
-        handle_resignation och handle_illness_insurance kan bara användas av Gröna Lund anställda. 
-        Svara detaljerat och steg-för-steg, och inkludera alla relevanta instruktioner eller
-        detaljer som du har tillgång till i kontexten. Var noga med att använda lookup_faq för att söka efter svar på 
-        medarbetarens frågor. Säkerställ också att query till lookup_faq är så semantiskt korrekt som möjligt utifrån de personen
-        frågar. Om du inte kan hitta ett svar med hjälp av information från verktygen, så uppge det tydligt för 
-        användaren och föreslå vänligt att personen kan kontakta Artistservice för hjälp med frågan.
-        Om någon frågar vem som illustrerat Backster så svara att det är Emelie Wiklund.
-        
-        Viktiga instruktioner: Svara aldrig på frågor som bygger på information som ligger utanför den du kan hämta från
-        verktygen. 
-        Var alltid vänlig och professionell i din kommunikation.
-        Svara alltid med text i markdown-format.
-        
-        """),
-        ("placeholder", "{messages}")
-    ])
-
-
-def create_assistant_runnable(llm, tools):
-    primary_prompt = create_primary_prompt()
-    return primary_prompt | llm.bind_tools(tools)
+    async def _cached_answer(self, question, park, employment):
+        # The cache is only an optimization, a failing embeddings call or SQLite is treated as a miss.
+        try:
+            # SQLite reads and writes block, so they run in a worker thread.
+            return await asyncio.to_thread(self.cache.lookup, await self.embed(question), park, employment)
+        except Exception:
+            logger.warning("Could not look up the question in the semantic cache.", exc_info=True)
+            return None
 
+    async def _stream(self, messages, config):
+        """
+        Streams the completion with the node's config, so that graph.astream consumers receive the tokens as they
+        are generated. The chunks are merged into the final AI message.
+        """
+        result = None
+        async for chunk in self.runnable.astream(messages, config):
+            result = chunk if result is None else result + chunk
+        if result is None:
+            return AIMessage(content="")
+        return message_chunk_to_message(result)
 
-tools = [lookup_faq, get_daily_park_data, handle_resignation, handle_lost_backstagepass, handle_illness_insurance,
-         handle_give_away_shift, handle_work_certificate_request]
-assistant_runnable = create_assistant_runnable(llm, tools)
+    async def _cache_faq_answer(self, state, result):
+        """Caches final answers that are based solely on the FAQ, other tools depend on the conversation."""
+        if result.tool_calls or not result.content:
+            return
+        question, turn = _current_turn(state["messages"])
+        tools_used = {message.name for message in turn if isinstance(message, ToolMessage)}
+        if question is None or tools_used != {"lookup_faq"}:
+            return
+        # The answer is cached with the sources it is based on, which are shown with it on a cache hit.
+        artifact = ParallelToolNode.faq_artifact(
+            [message for message in reversed(turn) if isinstance(message, ToolMessage)]).get("lookup_faq_artifact")
+        # Answers to later questions are written against the conversation and can repeat personal details from it.
+        if artifact is None or not _is_first_question(state["messages"]):
+            return
+        try:
+            embedding = await self.embed(question.content)
+            await asyncio.to_thread(self.cache.store, question.content, embedding, result.content, artifact,
+                                    state["park"], state["employmentType"])
+        except Exception:
+            logger.warning("Could not store the answer in the semantic cache.", exc_info=True)
 
-builder = StateGraph(State)
 
-builder.add_node("assistant", Assistant(assistant_runnable))
-builder.add_node("tools", ToolNode(tools))
-builder.add_edge(START, "assistant")
-builder.add_conditional_edges(
-    "assistant",
-    tools_condition
-)
-builder.add_edge("tools", "assistant")
-memory = MemorySaver()
+class ParallelToolNode:
+    """Runs all tool calls requested by the latest AI message concurrently, instead of one after another."""
+
+    def __init__(self, tools):
+        self.tools_by_name = {tool.name: tool for tool in tools}
+
+    async def __call__(self, state, config):
+        tool_calls = state["messages"][-1].tool_calls
+        tool_messages = await asyncio.gather(*[self.run_tool(tool_call, config) for tool_call in tool_calls])
+        return {"messages": list(tool_messages), **self.faq_artifact(tool_messages)}
+
+    @staticmethod
+    def faq_artifact(tool_messages) -> dict:
+        """Keeps the artifact of the latest FAQ lookup on the state, so it can be read without scanning the messages."""
+        for message in reversed(tool_messages):
+            if message.name == "lookup_faq" and message.artifact is not None:
+                return {"lookup_faq_artifact": message.artifact}
+        return {}
+
+    async def run_tool(self, tool_call, config):
+        try:
+            return await self.tools_by_name[tool_call["name"]].ainvoke({**tool_call, "type": "tool_call"}, config)
+        except Exception as e:
+            return ToolMessage(
+                content=f"Error: {repr(e)}\n please fix your mistakes.",
+                name=tool_call["name"],
+                tool_call_id=tool_call["id"],
+                status="error",
+            )
+
+
+SYSTEM_PROMPT = """Du är en hjälpsam och vänlig AI-assistent för medarbetare på {park}. Dagens datum är {current_date} och \
+klockan är {current_time}.
+Medarbetaren har anställningsformen {employmentType}, vilket är viktigt att du tar hänsyn till.
+Använd verktygen {tools} för att hjälpa medarbetaren.
+handle_resignation och handle_illness_insurance kan bara användas av Gröna Lund anställda.
+Använd alltid lookup_faq för att söka efter svar, med en query som är så semantiskt korrekt som möjligt utifrån det \
+personen frågar.
+Svara detaljerat och steg-för-steg, med alla relevanta instruktioner och detaljer från kontexten.
+Om verktygen inte ger något svar, uppge det tydligt och föreslå vänligt att personen kontaktar Artistservice.
+Om någon frågar vem som illustrerat Backster så svara att det är Emelie Wiklund.
+
+Viktiga instruktioner: Svara aldrig på frågor som bygger på information utanför den du kan hämta från verktygen.
+Var alltid vänlig och professionell. Svara alltid med text i markdown-format."""
+
+
+@lru_cache(maxsize=256)
+def render_system(park, employmentType, current_date, current_time, tools):
+    """Renders the system prompt once per combination of values, the same message is reused by all turns."""
+    return SystemMessage(content=SYSTEM_PROMPT.format(park=park, employmentType=employmentType,
+                                                      current_date=current_date, current_time=current_time,
+                                                      tools=tools))
+
+
+# Strict schemas make the model emit valid tool arguments, which lowers the rate of empty or unusable responses.
+assistant_runnable = llm.bind_tools(tools, tool_choice="auto", strict=True)
+
+# "react" lets the assistant call tools turn by turn, "planner" plans all tool calls up front.
+AGENT_MODE = os.getenv("AGENT_MODE") or "react"
+
+# A local embedding model makes the semantic cache lookup independent of the embeddings API.
+local_embedding_model = os.getenv("LOCAL_EMBEDDING_MODEL")
+if local_embedding_model:
+    local_embeddings = OnnxEmbeddings(local_embedding_model, pooling=os.getenv("LOCAL_EMBEDDING_POOLING") or "mean")
+    cache_embed, cache_namespace = local_embeddings.embed, local_embeddings.namespace
+else:
+    cache_embed, cache_namespace = embedding_batcher.embed, EMBEDDING_NAMESPACE
+
+# The nodes are shared by every graph that is built, so there is only one semantic cache connection and tool node.
+assistant = Assistant(assistant_runnable, cache_embed, cache_namespace,
+                      os.getenv("SEMANTIC_CACHE_PATH") or "semantic_cache.db")
+tool_node = ParallelToolNode(tools)
+planner = Planner(llm.bind(response_format={"type": "json_object"}), tool_node, tools)
+
+
+def cache_condition(state):
+    """Ends the turn on a cache hit, otherwise the question goes on to the planner or the assistant."""
+    return END if isinstance(state["messages"][-1], AIMessage) else "assistant"
+
+
+def build_graph(variant: str, checkpointer):
+    """Builds and compiles the agent graph for the given variant, "react" or "planner"."""
+    builder = StateGraph(State)
+    builder.add_node("router", route_message)
+    builder.add_node("cache", assistant.answer_from_cache)
+    builder.add_node("assistant", assistant)
+    builder.add_node("tools", tool_node)
+    builder.add_edge(START, "router")
+    builder.add_conditional_edges("router", route_condition, {"assistant": "cache", "tools": "tools", END: END})
+    if variant == "planner":
+        # The assistant joins the planned tool results into the answer, and can still call tools if the plan fell short.
+        builder.add_node("planner", planner)
+        builder.add_conditional_edges("cache", cache_condition, {"assistant": "planner", END: END})
+        builder.add_edge("planner", "assistant")
+    elif variant == "react":
+        builder.add_conditional_edges("cache", cache_condition, ["assistant", END])
+    else:
+        raise ValueError(f"Unknown agent variant: {variant}")
+    builder.add_conditional_edges(
+        "assistant",
+        tools_condition
+    )
+    builder.add_edge("tools", "assistant")
+    return builder.compile(checkpointer=checkpointer)
+
+
+graph = build_graph(AGENT_MODE, MemorySaver())
+
+
+@asynccontextmanager
+async def postgres_checkpointer(dsn: str):
+    """
+    Opens a pooled Postgres checkpointer, so conversations are shared between workers and survive restarts.
+    """
+    from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
+    from psycopg_pool import AsyncConnectionPool
 
-graph = builder.compile(checkpointer=memory)
+    async with AsyncConnectionPool(dsn, max_size=20, open=False,
+                                   kwargs={"autocommit": True, "prepare_threshold": 0}) as pool:
+        checkpointer = AsyncPostgresSaver(pool)
+        await checkpointer.setup()
+        yield checkpointer
@@ -1,25 +1,154 @@
+import asyncio
+import functools
+import logging
 import os
+import re
+import string
 from datetime import datetime, timedelta
+from pathlib import Path
 from typing import Literal
 
+import aiohttp
 import httpx
+import requests
 from azure.core.credentials import AzureKeyCredential
+from azure.core.pipeline.transport import AioHttpTransport, RequestsTransport
 from azure.search.documents import SearchClient
+from azure.search.documents.aio import SearchClient as AsyncSearchClient
 from azure.search.documents._generated.models import VectorizedQuery
 from langchain_core.messages import ToolMessage
 from langchain_core.tools import tool
 from langchain_openai import AzureOpenAIEmbeddings
-from sendgrid import SendGridAPIClient
+from requests.adapters import HTTPAdapter
 from sendgrid.helpers.mail import Mail
 
-embeddings_model = AzureOpenAIEmbeddings(
-    model="text-embedding-ada-002",
-    azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
-    openai_api_key=os.getenv("AZURE_OPENAI_API_KEY")
-)
+from ai_backend import mailer
+from ai_backend.embedding_batcher import EmbeddingBatcher
+from ai_backend.local_index import RESULT_FIELDS, LocalVectorIndex
+from ai_backend.redis_cache import RedisEmbeddingCache
+from ai_backend.reranker import CrossEncoderReranker
+from ai_backend.search_cache import SearchResultCache
+from ai_backend.ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+SEARCH_MAX_CONNECTIONS = 50
+SEARCH_KEEPALIVE_TIMEOUT = 30
+
+
+# The Azure clients are created on first use, so importing the tools doesn't build clients or validate credentials.
+@functools.cache
+def get_embeddings_model() -> AzureOpenAIEmbeddings:
+    # The contentVector field of the search index must be embedded with the same model and dimensions.
+    return AzureOpenAIEmbeddings(
+        model="text-embedding-3-small",
+        dimensions=512,
+        azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+        openai_api_key=os.getenv("AZURE_OPENAI_API_KEY")
+    )
+
+
+@functools.cache
+def get_search_credential() -> AzureKeyCredential:
+    """Shared by both search clients."""
+    return AzureKeyCredential(os.getenv("AZURE_AI_SEARCH_API_KEY"))
+
+
+@functools.cache
+def get_search_client() -> SearchClient:
+    """Sync client, only used to load the local index in a background thread."""
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=4))
+    return SearchClient(os.getenv("AZURE_AI_SEARCH_ENDPOINT"), "backster-first", get_search_credential(),
+                        transport=RequestsTransport(session=session, connection_timeout=5, read_timeout=60))
+
 
-search_client = SearchClient(os.getenv("AZURE_AI_SEARCH_ENDPOINT"), "backster-first",
-                             AzureKeyCredential(os.getenv("AZURE_AI_SEARCH_API_KEY")))
+@functools.cache
+def get_async_search_client() -> AsyncSearchClient:
+    """
+    Async client that serves the FAQ lookups without blocking the event loop. Its aiohttp session keeps up to
+    SEARCH_MAX_CONNECTIONS connections to Azure AI Search open, so concurrent lookups don't repeat the TLS
+    handshake. Has to be called from the event loop, which the session is bound to.
+    """
+    session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=SEARCH_MAX_CONNECTIONS,
+                                                                   keepalive_timeout=SEARCH_KEEPALIVE_TIMEOUT))
+    return AsyncSearchClient(os.getenv("AZURE_AI_SEARCH_ENDPOINT"), "backster-first", get_search_credential(),
+                             transport=AioHttpTransport(session=session, connection_timeout=5, read_timeout=30))
+
+
+# Caches of embeddings are namespaced by the model, so a model change never compares vectors of different models.
+EMBEDDING_NAMESPACE = "text-embedding-3-small:512"
+
+# Optional embedding cache shared between workers.
+redis_url = os.getenv("REDIS_URL")
+shared_embedding_cache = RedisEmbeddingCache(redis_url, EMBEDDING_NAMESPACE) if redis_url else None
+embedding_batcher = EmbeddingBatcher(get_embeddings_model,
+                                     max_batch_size=int(os.getenv("EMBEDDING_BATCH_SIZE") or 16),
+                                     max_wait=float(os.getenv("EMBEDDING_BATCH_WAIT_MS") or 10) / 1000,
+                                     cache_path=os.getenv("EMBEDDING_CACHE_PATH") or None,
+                                     shared_cache=shared_embedding_cache)
+
+# Shared client so that calls to the backstageinfo API reuse pooled keep-alive connections.
+http_client = httpx.AsyncClient(base_url="https://backstageinfo.azurewebsites.net", timeout=httpx.Timeout(5.0),
+                                limits=httpx.Limits(max_keepalive_connections=20, max_connections=50))
+
+# Daily park data rarely changes during the day, closed days are cached shorter so a newly opened day shows up quickly.
+park_data_cache = TTLCache(maxsize=512, ttl=600)
+CLOSED_PARK_DATA_TTL = 60
+# Data for days that have passed doesn't change anymore.
+PAST_PARK_DATA_TTL = 24 * 60 * 60
+
+# In-memory mirror of the search index, FAQ lookups only go to Azure AI Search until it has been loaded.
+local_index = LocalVectorIndex(get_search_client) if os.getenv("LOCAL_SEARCH_INDEX", "true").lower() != "false" else None
+# Repeated and near-duplicate FAQ questions reuse earlier search results without a new search.
+search_cache = SearchResultCache(ttl=float(os.getenv("SEARCH_CACHE_TTL") or 15 * 60), min_similarity=0.95)
+# Short questions are semantic, so full-text scoring is only combined with the vector search for longer queries.
+MIN_FULL_TEXT_QUERY_WORDS = 4
+# Filter conditions per (annual_employee, seasonal_employee), without a condition every employment type matches.
+EMPLOYEE_FILTERS = {
+    (True, True): " and (annual_employee eq true or seasonal_employee eq true)",
+    (True, False): " and (annual_employee eq true)",
+    (False, True): " and (seasonal_employee eq true)",
+    (False, False): "",
+}
+# The full-text and vector results are merged with reciprocal rank fusion, RRF_K damps the weight of the top ranks.
+KEYWORD_SEARCH_TOP = 10
+RRF_K = 60
+SEARCH_TOP = 3
+# Optional cross-encoder, e.g. BAAI/bge-reranker-v2-m3, that picks the SEARCH_TOP results out of RERANK_CANDIDATES.
+# Queries of one or two words are mostly literal, so they aren't reranked.
+reranker = CrossEncoderReranker(os.getenv("RERANKER_MODEL")) if os.getenv("RERANKER_MODEL") else None
+RERANK_CANDIDATES = 30
+MIN_RERANK_QUERY_WORDS = 3
+
+# Read once at import, so a missing address fails at startup instead of when the first email is sent.
+SEND_FROM_EMAIL = os.environ["SEND_FROM_EMAIL"]
+SEND_TO_EMAIL = os.environ["SEND_TO_EMAIL"]
+
+# Email bodies are kept as html files and parsed once at import.
+EMAIL_TEMPLATES_DIR = Path(__file__).parent / "email_templates"
+
+
+def _load_template(name: str) -> string.Template:
+    return string.Template((EMAIL_TEMPLATES_DIR / name).read_text(encoding="utf-8"))
+
+
+RESIGNATION_TEMPLATE = _load_template("resignation.html")
+LOST_BACKSTAGEPASS_TEMPLATE = _load_template("lost_backstagepass.html")
+WORK_CERTIFICATE_TEMPLATE = _load_template("work_certificate.html")
+GIVE_AWAY_SHIFT_TEMPLATE = _load_template("give_away_shift.html")
+ILLNESS_INSURANCE_TEMPLATE = _load_template("illness_insurance.html")
+
+# fromisoformat also accepts other ISO 8601 forms, the tools only take YYYY-MM-DD.
+ISO_DATE_RE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+RESIGNATION_NOTICE_PERIOD = timedelta(days=14)
+
+park_code_map = {
+    "Gröna Lund": '03',
+    "Furuvik": '13',
+    "Kolmården": '02',
+    "Skara Sommarland": '05'
+}
 
 artistservice_mail_park_map = {
         "Gröna Lund": 'artistservice@gronalund.com',
@@ -28,32 +157,126 @@ artistservice_mail_park_map = {
         "Skara Sommarland": 'artistservice@sommarland.se'
     }
 
-def hybrid_search(query: str, park: str, annual_employee: bool, seasonal_employee: bool):
-    embedded_query = embeddings_model.embed_query(query)
-    content_vector_query = VectorizedQuery(vector=embedded_query, k_nearest_neighbors=3, fields="contentVector")
+async def hybrid_search(query: str, park: str, annual_employee: bool, seasonal_employee: bool):
+    filter_key = (park, annual_employee, seasonal_employee)
+    cached_results = search_cache.get(filter_key, query)
+    if cached_results is not None:
+        return cached_results
+
+    rerank = reranker is not None and len(query.split()) >= MIN_RERANK_QUERY_WORDS
+    top = RERANK_CANDIDATES if rerank else SEARCH_TOP
+    search_filter = SEARCH_FILTERS.get(filter_key) or _search_filter(park, annual_employee, seasonal_employee)
+    # The full-text search doesn't need the embedding, so it runs while the query is being embedded.
+    keyword_task = asyncio.create_task(_keyword_search(query, search_filter, max(top, KEYWORD_SEARCH_TOP))) \
+        if len(query.split()) >= MIN_FULL_TEXT_QUERY_WORDS else None
+    try:
+        embedded_query = await embedding_batcher.embed(query)
+        cached_results = search_cache.lookup(filter_key, embedded_query)
+        if cached_results is not None:
+            return cached_results
+
+        results = await _vector_search(embedded_query, park, annual_employee, seasonal_employee, search_filter, top)
+        if keyword_task is not None:
+            try:
+                results = _reciprocal_rank_fusion(results, await keyword_task, top=top)
+            except Exception:
+                logger.warning("Full-text search failed, using the vector search results only.", exc_info=True)
+        if rerank:
+            try:
+                results = await reranker.rerank(query, results, SEARCH_TOP)
+            except Exception:
+                logger.warning("Reranking failed, using the search ranking.", exc_info=True)
+                results = results[:SEARCH_TOP]
+    finally:
+        if keyword_task is not None and not keyword_task.done():
+            keyword_task.cancel()
+
+    search_cache.store(filter_key, query, embedded_query, results)
+    logger.debug("FAQ search for %r returned %s", query, [result["source"] for result in results])
+    return results
+
+
+def _search_filter(park: str, annual_employee: bool, seasonal_employee: bool) -> str:
+    return f"park eq '{park}'" + EMPLOYEE_FILTERS[(annual_employee, seasonal_employee)]
 
-    # Construct filter
-    combined_filter = f"park eq '{park}'"
-    # Add conditions for employee type
-    employee_filters = []
-    if annual_employee:
-        employee_filters.append("annual_employee eq true")
-    if seasonal_employee:
-        employee_filters.append("seasonal_employee eq true")
 
-    # Add combined filter if any employee filters are present
-    if employee_filters:
-        combined_filter += f" and ({' or '.join(employee_filters)})"
+# The filters for every park and employment type combination, so they aren't rebuilt for each search.
+SEARCH_FILTERS = {(park, annual_employee, seasonal_employee): _search_filter(park, annual_employee, seasonal_employee)
+                  for park in park_code_map for annual_employee in (True, False) for seasonal_employee in (True, False)}
 
-    results = search_client.search(
+
+async def _keyword_search(query: str, search_filter: str, top: int) -> list[dict]:
+    results = await get_async_search_client().search(
         search_text=query,
+        select=RESULT_FIELDS,
+        top=top,
+        filter=search_filter
+    )
+    return await _collect(results, top)
+
+
+async def _vector_search(embedded_query: list[float], park: str, annual_employee: bool, seasonal_employee: bool,
+                         search_filter: str, top: int) -> list[dict]:
+    if local_index is not None:
+        local_results = local_index.search(embedded_query, park, annual_employee, seasonal_employee, k=top)
+        if local_results:
+            return local_results
+
+    content_vector_query = VectorizedQuery(vector=embedded_query, k_nearest_neighbors=top, fields="contentVector")
+    results = await get_async_search_client().search(
+        search_text=None,
         vector_queries=[content_vector_query],
-        select=["title", "content", "park", "source", "id", "original_content", "message_id"],
-        top=3,
-        filter=combined_filter
+        select=RESULT_FIELDS,
+        top=top,
+        filter=search_filter
     )
-    results = list(results)
-    return results
+    return await _collect(results, top)
+
+
+async def _collect(results, top: int) -> list[dict]:
+    """
+    Reads at most top results, so the pager never fetches another page, and keeps only the result fields. The plain
+    dicts are what the search cache holds, without the search scores and highlights of the SDK results.
+    """
+    collected = []
+    async for result in results:
+        collected.append({field: result[field] for field in RESULT_FIELDS})
+        if len(collected) >= top:
+            break
+    return collected
+
+
+def _reciprocal_rank_fusion(*result_lists: list[dict], top: int = SEARCH_TOP) -> list[dict]:
+    """Merges ranked result lists by summing 1 / (RRF_K + rank) per document, the fusion Azure uses for hybrid search."""
+    scores = {}
+    documents = {}
+    for results in result_lists:
+        for rank, result in enumerate(results, start=1):
+            key = (result["source"], result["content"])
+            scores[key] = scores.get(key, 0) + 1 / (RRF_K + rank)
+            documents.setdefault(key, result)
+    return [documents[key] for key in sorted(scores, key=scores.get, reverse=True)[:top]]
+
+
+def parse_date(value: str) -> datetime | None:
+    """Parses a YYYY-MM-DD date, returns None if the value isn't a valid date in that format."""
+    if not ISO_DATE_RE.match(value):
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return None
+
+
+async def close_clients():
+    """Closes the shared network clients, should be called when the application shuts down."""
+    await http_client.aclose()
+    if get_async_search_client.cache_info().currsize:
+        await get_async_search_client().close()
+    await mailer.close()
+    embedding_batcher.save_cache()
+    if shared_embedding_cache is not None:
+        await shared_embedding_cache.close()
 
 
 def handle_tool_error(state) -> dict:
@@ -71,7 +294,7 @@ def handle_tool_error(state) -> dict:
 
 
 @tool(response_format="content_and_artifact")
-def lookup_faq(query: str, park: str, employment_type: Literal['Tillsvidare', 'Säsong/Visstid']):
+async def lookup_faq(query: str, park: str, employment_type: Literal['Tillsvidare', 'Säsong/Visstid']):
     """
     Searches the company's internal knowledge base to find answers for user questions.
     This tool should always be used before answering a user's question as it provides the
@@ -89,19 +312,22 @@ def lookup_faq(query: str, park: str, employment_type: Literal['Tillsvidare', 'S
                 - sources (list[str]): A list of source paths used in the context.
                 - original_contents (list[str]): A list of original content pieces retrieved during the search.
     """
-    rag_results = hybrid_search(query,
-                                park,
-                                annual_employee=employment_type == "Tillsvidare",
-                                seasonal_employee=employment_type == "Säsong/Visstid"
-                                )
-    sources = [result["source"] for result in rag_results]
-    original_contents = [content["original_content"] for content in rag_results]
-    context = "\n".join([content["content"] for content in rag_results])
+    rag_results = await hybrid_search(query,
+                                      park,
+                                      annual_employee=employment_type == "Tillsvidare",
+                                      seasonal_employee=employment_type == "Säsong/Visstid"
+                                      )
+    sources, original_contents, contents = [], [], []
+    for result in rag_results:
+        sources.append(result["source"])
+        original_contents.append(result["original_content"])
+        contents.append(result["content"])
+    context = "\n".join(contents)
     return context, {"sources": sources, "original_contents": original_contents}
 
 
 @tool
-def get_daily_park_data(park: Literal["Gröna Lund", "Furuvik", "Kolmården", "Skara Sommarland"], date: str) -> dict:
+async def get_daily_park_data(park: Literal["Gröna Lund", "Furuvik", "Kolmården", "Skara Sommarland"], date: str) -> dict:
     """
     Fetches daily information for a specific date regarding the parks.
 
@@ -116,30 +342,33 @@ def get_daily_park_data(park: Literal["Gröna Lund", "Furuvik", "Kolmården", "S
         dict: A dictionary containing the park's daily information. If the park name is invalid or
         data retrieval fails, the dictionary will contain an "error" key with an appropriate message.
     """
-    park_map = {
-        "Gröna Lund": '03',
-        "Furuvik": '13',
-        "Kolmården": '02',
-        "Skara Sommarland": '05'
-    }
-    park_code = park_map.get(park)
+    park_code = park_code_map.get(park)
     if not park_code:
         return {"error": "Invalid park name"}
 
-    url = f"https://backstageinfo.azurewebsites.net/{park_code}/{date}"
-    response = httpx.get(url)
+    cached_data = park_data_cache.get((park, date))
+    if cached_data is not None:
+        return cached_data
+
+    response = await http_client.get(f"/{park_code}/{date}")
 
+    parsed_date = parse_date(date)
+    is_past = parsed_date is not None and parsed_date.date() < datetime.now().date()
     if response.status_code == 404:
-        return {"info": "Parken är inte öppen denna dag"}
+        park_data = {"info": "Parken är inte öppen denna dag"}
+        park_data_cache.set((park, date), park_data, ttl=PAST_PARK_DATA_TTL if is_past else CLOSED_PARK_DATA_TTL)
+        return park_data
     if response.status_code != 200:
         return {"error": "Failed to retrieve data"}
 
-    return response.json()
+    park_data = response.json()
+    park_data_cache.set((park, date), park_data, ttl=PAST_PARK_DATA_TTL if is_past else None)
+    return park_data
 
 
 @tool
-def handle_resignation(employee_name: str, email_adress: str, resignation_date: str,
-                       reason: str, park: Literal["Gröna Lund", "Furuvik", "Kolmården", "Skara Sommarland"]):
+async def handle_resignation(employee_name: str, email_adress: str, resignation_date: str,
+                             reason: str, park: Literal["Gröna Lund", "Furuvik", "Kolmården", "Skara Sommarland"]):
     """
     Handles the resignation process for a Gröna Lund employee by asking for the full name, resignation date, email adress and reason.
     When the employee is asking for resignation, inform the employee that it has a minimum notice period
@@ -171,48 +400,36 @@ def handle_resignation(employee_name: str, email_adress: str, resignation_date:
     if not reason:
         return "Vad är anledningen till att du vill säga upp dig?"
 
-    try:
-        resignation_date = datetime.strptime(resignation_date, "%Y-%m-%d")
-    except ValueError:
+    resignation_date = parse_date(resignation_date)
+    if resignation_date is None:
         return "Datumet måste vara i formatet YYYY-MM-DD."
 
-    if resignation_date <= datetime.now() + timedelta(days=14):
+    if resignation_date <= datetime.now() + RESIGNATION_NOTICE_PERIOD:
         return "Uppsägningen kan inte göras tidigare än 14 dagar från idag."
 
 
+    artistservice_mail = artistservice_mail_park_map.get(park, "error")
     message = Mail(
-        from_email=os.getenv("SEND_FROM_EMAIL"),
-        to_emails=os.getenv("SEND_TO_EMAIL"),
+        from_email=SEND_FROM_EMAIL,
+        to_emails=SEND_TO_EMAIL,
         subject=f"Backster: Uppsägning från {employee_name}",
-        html_content=f"""
-
-        <h1>Backster: Uppsägning av anställning</h1>
-        <p>Hej!</p>
-        <p>Jag har mottagit en anmälan om uppsägning från <span class="highlight">{employee_name}</span> med kontaktuppgifter: 
-        <span class="highlight">{email_adress}</span>.</p>
-        <p>{employee_name} önskar att säga upp sig och har angett att sista arbetsdagen ska vara <span class="highlight">{resignation_date.strftime("%Y-%m-%d")}</span>.</p>
-        <p>Angiven anledning till uppsägningen är: <span class="highlight">{reason}</span>.</p>
-        <p>Vänligen kontakta {employee_name} för ytterligare frågor eller för att bekräfta uppsägningen.</p>
-        <p>Med vänliga hälsningar,</p>
-        <p>Backster</p>
-        <p>TEST RAD! Jag kommer skicka till {artistservice_mail_park_map.get(park, "error")} när vi går live</p>
-        """)
-
-    try:
-        sg = SendGridAPIClient(os.getenv("SENDGRID_API_KEY"))
-        response = sg.send(message)
+        html_content=RESIGNATION_TEMPLATE.substitute(
+            employee_name=employee_name,
+            email_adress=email_adress,
+            resignation_date=resignation_date.strftime("%Y-%m-%d"),
+            reason=reason,
+            artistservice_mail=artistservice_mail
+        ))
 
-        if response.status_code != 202:
-            raise Exception("Failed to send email")
-    except Exception as e:
-        return f"""Jag kunde tyvärr inte skicka informationen till Artistservice. Vänligen försök igen senare eller kontakta Artistservice direkt."""
+    # The employee doesn't need to wait for SendGrid, failed sends are retried and logged in the background.
+    mailer.send_mail_in_background(message)
 
     return "Jag har nu skickat informationen till Artistservice. Dom kommer återkoppla till dig inom kort."
 
 
 @tool
-def handle_lost_backstagepass(full_name: str, email_address: str,
-                              park: Literal["Gröna Lund", "Furuvik", "Kolmården", "Skara Sommarland"]):
+async def handle_lost_backstagepass(full_name: str, email_address: str,
+                                    park: Literal["Gröna Lund", "Furuvik", "Kolmården", "Skara Sommarland"]):
     """
     Handles the situation when an employee has lost their Backstage pass.
     The tool will guide the employee through the process of putting together the correct information to Artistservice.
@@ -230,41 +447,27 @@ def handle_lost_backstagepass(full_name: str, email_address: str,
     if not email_address:
         return "För att skicka informationen till Artistservice behöver jag din mailadress."
 
+    artistservice_mail = artistservice_mail_park_map.get(park, "error")
     message = Mail(
-        from_email=os.getenv("SEND_FROM_EMAIL"),
-        to_emails=os.getenv("SEND_TO_EMAIL"),
+        from_email=SEND_FROM_EMAIL,
+        to_emails=SEND_TO_EMAIL,
         subject=f"Backster: {full_name} önskar spärra sitt Backstagepass",
-        html_content=f"""
-            <h1>Backster: Spärr av Backstagepass</h1>
-            <p>Hej!</p>
-            <p>{full_name} har tappat sitt Backstagepass och önskar att spärra det. Jag har informerat {full_name} att 
-            komma till Artistservice för att få ett nytt pass.
-             Om ni vill kontakta {full_name} så har hen uppgett följande mailadress:</p>
-            <p>{email_address}</p>
-            <p>Med vänliga hälsningar, Backster</p>
-            
-            <p>TEST RAD! Jag kommer skicka till {artistservice_mail_park_map.get(park, "error")} när vi går live</p>
-            """)
+        html_content=LOST_BACKSTAGEPASS_TEMPLATE.substitute(
+            full_name=full_name,
+            email_address=email_address,
+            artistservice_mail=artistservice_mail
+        ))
 
-    try:
-        sg = SendGridAPIClient(os.getenv("SENDGRID_API_KEY"))
-        response = sg.send(message)
-
-        if response.status_code != 202:
-            raise Exception("Failed to send email")
-
-    except Exception as e:
-        return f"""Jag kunde tyvärr inte skicka informationen till Artistservice. 
-        Försök igen senare eller kontakta Aristservice direkt."""
+    mailer.send_mail_in_background(message)
 
     return f"""Jag har nu skickat informationen till Artistservice. Kom in till Artistservice för att hämta ett nytt Backstagepass."""
 
 
 @tool
-def handle_work_certificate_request(certificate_type: Literal['arbetsintyg', 'arbetsbetyg'],
-                                    full_name: str,
-                                    email_address: str,
-                                    park: Literal["Gröna Lund", "Furuvik", "Kolmården", "Skara Sommarland"]):
+async def handle_work_certificate_request(certificate_type: Literal['arbetsintyg', 'arbetsbetyg'],
+                                          full_name: str,
+                                          email_address: str,
+                                          park: Literal["Gröna Lund", "Furuvik", "Kolmården", "Skara Sommarland"]):
     """
     Handles the situation when an employee requests a work certificate.
     The tool will guide the employee through the process of putting together the correct information to Artistservice.
@@ -286,27 +489,19 @@ def handle_work_certificate_request(certificate_type: Literal['arbetsintyg', 'ar
     if certificate_type not in ['arbetsintyg', 'arbetsbetyg']:
         return "Vänligen ange vilken typ av intyg du önskar, antingen 'arbetsintyg' eller 'arbetsbetyg'."
 
+    artistservice_mail = artistservice_mail_park_map.get(park, "error")
     message = Mail(
-        from_email=os.getenv("SEND_FROM_EMAIL"),
-        to_emails=os.getenv("SEND_TO_EMAIL"),
+        from_email=SEND_FROM_EMAIL,
+        to_emails=SEND_TO_EMAIL,
         subject=f"Backster: Begäran om {certificate_type}",
-        html_content=
-        f"""
-    <h1>Begäran om {certificate_type}</h1>
-        <p>Hej!</p>
-        <p><span class="highlight">{full_name}</span> önskar att få ett <span class="highlight">{certificate_type}</span> vid avslutad säsong.</p>
-        <p>Personens mail-adress är: <span class="highlight">{email_address}</span>.</p>
-            <p>Med vänliga hälsningar, Backster</p>
-
-    <p>TEST RAD! Jag kommer skicka till {artistservice_mail_park_map.get(park, "error")} när vi går live</p>
-    """)
+        html_content=WORK_CERTIFICATE_TEMPLATE.substitute(
+            certificate_type=certificate_type,
+            full_name=full_name,
+            email_address=email_address,
+            artistservice_mail=artistservice_mail
+        ))
     try:
-        sg = SendGridAPIClient(os.getenv("SENDGRID_API_KEY"))
-        response = sg.send(message)
-
-        if response.status_code != 202:
-            raise Exception("Failed to send email")
-
+        await mailer.send_mail(message)
     except Exception as e:
         return f"""Jag kunde tyvärr inte skicka informationen till Artistservice. 
         Försök igen senare eller kontakta Artistservice direkt."""
@@ -315,11 +510,11 @@ def handle_work_certificate_request(certificate_type: Literal['arbetsintyg', 'ar
 
 
 @tool
-def handle_give_away_shift(full_name: str, email_address: str,
-                           shift_date: str,
-                           shift_receiver_full_name: str,
-                           shift_receiver_email: str,
-                           park: Literal["Gröna Lund", "Furuvik", "Kolmården", "Skara Sommarland"]):
+async def handle_give_away_shift(full_name: str, email_address: str,
+                                 shift_date: str,
+                                 shift_receiver_full_name: str,
+                                 shift_receiver_email: str,
+                                 park: Literal["Gröna Lund", "Furuvik", "Kolmården", "Skara Sommarland"]):
     """
     Handles the situation when an employee wants to give away a shift to another employee.
     The tool will guide the employee through the process of putting together the correct information to Artistservice.
@@ -328,7 +523,7 @@ def handle_give_away_shift(full_name: str, email_address: str,
     Args:
         full_name (str): The full name of the employee that want to give away shift.
         email_address (str): The email address of the employee that want to give away shift.
-        shift_date (str): The date of the shift to be given away.
+        shift_date (str): The date of the shift to be given away, formatted as YYYY-MM-DD.
         shift_receiver_full_name (str): The full name of the employee who will receive the shift.
         shift_receiver_email (str): The email address of the employee who will receive the shift.
 
@@ -342,30 +537,27 @@ def handle_give_away_shift(full_name: str, email_address: str,
         return "För att skicka informationen till mottagaren behöver jag din mailadress."
     if not shift_date:
         return "Vilket datum är det för skiftet du vill ge bort?"
+    if parse_date(shift_date) is None:
+        return "Datumet måste vara i formatet YYYY-MM-DD."
     if not shift_receiver_full_name:
         return "För att skicka informationen till mottagaren behöver jag mottagarens fullständiga namn."
     if not shift_receiver_email:
         return "För att skicka informationen till mottagaren behöver jag mottagarens mailadress."
 
+    artistservice_mail = artistservice_mail_park_map.get(park, "error")
     message = Mail(
-        from_email=os.getenv("SEND_FROM_EMAIL"),
+        from_email=SEND_FROM_EMAIL,
         to_emails=shift_receiver_email,
         subject=f"Backster: {full_name} önskar ge bort ett pass",
-        html_content=f"""
-    <h1>Övertagande av arbetspass</h1>
-    <p>Hej <span class="highlight">{shift_receiver_full_name}</span>!</p>
-    <p>Din kollega <span class="highlight">{full_name}</span> har ett pass den <span class="highlight">{shift_date}</span> som hen önskar att du tar över.</p>
-    <p>För att bekräfta övertagandet, vänligen vidarebefordra detta e-postmeddelande till <span class="highlight">{artistservice_mail_park_map.get(park, "error")}</span>.</p>
-    <p>Om du har några frågor, tveka inte att kontakta Artistservice.</p>
-    <p>Med vänliga hälsningar,</p>
-    <p>Backster</p>""")
+        html_content=GIVE_AWAY_SHIFT_TEMPLATE.substitute(
+            shift_receiver_full_name=shift_receiver_full_name,
+            full_name=full_name,
+            shift_date=shift_date,
+            artistservice_mail=artistservice_mail
+        ))
 
     try:
-        sg = SendGridAPIClient(os.getenv("SENDGRID_API_KEY"))
-        response = sg.send(message)
-
-        if response.status_code != 202:
-            raise Exception("Failed to send email")
+        await mailer.send_mail(message)
     except Exception as e:
         return f"""Jag kunde tyvärr inte skicka informationen till mottagaren. 
         Försök igen senare eller kontakta Artistservice"""
@@ -374,10 +566,10 @@ def handle_give_away_shift(full_name: str, email_address: str,
 
 
 @tool
-def handle_illness_insurance(full_name: str,
-                             email_address: str,
-                             sick_leave_dates: list[str],
-                             park: Literal["Gröna Lund", "Furuvik", "Kolmården", "Skara Sommarland"]):
+async def handle_illness_insurance(full_name: str,
+                                   email_address: str,
+                                   sick_leave_dates: list[str],
+                                   park: Literal["Gröna Lund", "Furuvik", "Kolmården", "Skara Sommarland"]):
     """
     Handles the situation when an employee want to register a illness insurance.
     The tool will guide the employee through the process of putting together the correct information to Artistservice.
@@ -405,25 +597,20 @@ def handle_illness_insurance(full_name: str,
 
     sick_leave_dates = ", ".join(sick_leave_dates)
 
+    artistservice_mail = artistservice_mail_park_map.get(park, "error")
     message = Mail(
-        from_email=os.getenv("SEND_FROM_EMAIL"),
-        to_emails=os.getenv("SEND_TO_EMAIL"),
+        from_email=SEND_FROM_EMAIL,
+        to_emails=SEND_TO_EMAIL,
         subject=f"Backster: Sjukförsäkran från {full_name}",
-        html_content=f"""<p>{full_name} har varit hemma sjuk under följande datum: {sick_leave_dates}. Och önskar
-        att registrera en sjukdomsförsäkran. Kontakta {full_name} på {email_address} för ytterligare information.
-        </p>
-        <p>Med vänliga hälsningar, Backster</p>
-        
-        <p>TEST RAD! Jag kommer skicka till {artistservice_mail_park_map.get(park, "error")} när vi går live</p>
-        """)
+        html_content=ILLNESS_INSURANCE_TEMPLATE.substitute(
+            full_name=full_name,
+            sick_leave_dates=sick_leave_dates,
+            email_address=email_address,
+            artistservice_mail=artistservice_mail
+        ))
 
     try:
-        sg = SendGridAPIClient(os.getenv("SENDGRID_API_KEY"))
-        response = sg.send(message)
-
-        if response.status_code != 202:
-            raise Exception("Failed to send email")
-
+        await mailer.send_mail(message)
     except Exception as e:
         return f"""Jag kunde tyvärr inte skicka informationen till Artistservice. 
         Försök igen senare eller kontakta Artistservice direkt."""
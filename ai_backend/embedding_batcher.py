@@ -0,0 +1,139 @@
+import asyncio
+import logging
+import pickle
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def _token_upper_bound(text: str) -> int:
+    # Every token is at least one byte, so the UTF-8 length bounds the token count without loading a tokenizer.
+    return len(text.encode("utf-8"))
+
+
+class EmbeddingBatcher:
+    """
+    Coalesces concurrent embedding requests into a single call to the embeddings API.
+
+    Queries are collected for up to max_wait seconds, or until max_batch_size queries or max_batch_tokens tokens are
+    waiting, and are then embedded with one aembed_documents call. Each caller gets its own embedding back through a
+    future. get_embeddings_model is only called when a batch is sent, so the model can be created on first use.
+
+    The embeddings of the last cache_size queries are kept in an LRU cache keyed by the normalized query, so
+    repeated questions don't call the API at all, and a query that is already being embedded isn't sent again. If
+    cache_path is given the cache is loaded from and saved to that file, so it survives restarts. A shared_cache,
+    like RedisEmbeddingCache, is checked after the in-memory cache so workers reuse each other's embeddings.
+    """
+
+    def __init__(self, get_embeddings_model, max_batch_size: int = 16, max_wait: float = 0.01,
+                 max_batch_tokens: int = 8191, cache_size: int = 4096, cache_path: str | None = None,
+                 shared_cache=None):
+        self.get_embeddings_model = get_embeddings_model
+        self.max_batch_size = max_batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.max_wait = max_wait
+        self.cache_size = cache_size
+        self.cache_path = cache_path
+        self.shared_cache = shared_cache
+        self._cache = self._load_cache()
+        self._pending = {}
+        self._loop = None
+        self._queue = None
+        self._worker = None
+        self._carry_over = None
+
+    def _load_cache(self):
+        if not self.cache_path:
+            return OrderedDict()
+        try:
+            with open(self.cache_path, "rb") as file:
+                return OrderedDict(pickle.load(file))
+        except FileNotFoundError:
+            return OrderedDict()
+        except Exception:
+            logger.exception("Could not load the embedding cache from %s, starting empty.", self.cache_path)
+            return OrderedDict()
+
+    def save_cache(self):
+        if not self.cache_path:
+            return
+        with open(self.cache_path, "wb") as file:
+            pickle.dump(list(self._cache.items()), file)
+
+    async def embed(self, query: str) -> list[float]:
+        key = " ".join(query.lower().split())
+        embedding = self._cache.get(key)
+        if embedding is not None:
+            self._cache.move_to_end(key)
+            return list(embedding)
+
+        # Concurrent requests for the same query share one embedding call.
+        pending = self._pending.get(key)
+        if pending is None:
+            pending = asyncio.ensure_future(self._embed_shared(key, query))
+            self._pending[key] = pending
+            pending.add_done_callback(lambda _: self._pending.pop(key, None))
+        embedding = await asyncio.shield(pending)
+        self._cache[key] = tuple(embedding)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return list(embedding)
+
+    async def _embed_shared(self, key: str, query: str) -> list[float]:
+        if self.shared_cache is None:
+            return await self._embed(query)
+        embedding = await self.shared_cache.get(key)
+        if embedding is None:
+            embedding = await self._embed(query)
+            await self.shared_cache.set(key, embedding)
+        return embedding
+
+    async def _embed(self, query: str) -> list[float]:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._worker.done():
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._carry_over = None
+            self._worker = loop.create_task(self._run())
+
+        future = loop.create_future()
+        await self._queue.put((query, future))
+        return await future
+
+    async def _next_batch(self):
+        if self._carry_over is not None:
+            batch, self._carry_over = [self._carry_over], None
+        else:
+            batch = [await self._queue.get()]
+        tokens = _token_upper_bound(batch[0][0])
+        deadline = self._loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - self._loop.time()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(self._queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            tokens += _token_upper_bound(item[0])
+            if tokens > self.max_batch_tokens:
+                # Starts the next batch instead, so a request never exceeds the token limit of the API.
+                self._carry_over = item
+                break
+            batch.append(item)
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._next_batch()
+            try:
+                embeddings = await self.get_embeddings_model().aembed_documents([query for query, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            for (_, future), embedding in zip(batch, embeddings):
+                if not future.done():
+                    future.set_result(embedding)
@@ -0,0 +1,44 @@
+import asyncio
+from pathlib import Path
+from typing import Literal
+
+import numpy as np
+
+
+class OnnxEmbeddings:
+    """
+    Embeds questions locally with an ONNX export of a small sentence embedding model, like all-MiniLM or bge-small.
+
+    Only used as the key of the semantic answer cache, so a cache lookup doesn't wait for the embeddings API. The FAQ
+    search keeps the Azure OpenAI embeddings the index is built with. model_dir has to contain the model.onnx and
+    tokenizer.json of the model. pooling has to match the model, all-MiniLM averages the token embeddings ("mean")
+    and bge-small uses the embedding of the first token ("cls").
+    """
+
+    def __init__(self, model_dir: str, pooling: Literal["mean", "cls"] = "mean", max_length: int = 256):
+        if pooling not in ("mean", "cls"):
+            raise ValueError(f"Unknown pooling: {pooling}")
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        self.session = onnxruntime.InferenceSession(str(Path(model_dir) / "model.onnx"),
+                                                    providers=["CPUExecutionProvider"])
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+        self.tokenizer = Tokenizer.from_file(str(Path(model_dir) / "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length)
+        self.pooling = pooling
+        # Keeps cached embeddings of different models apart, also when they have the same dimension.
+        self.namespace = f"onnx:{Path(model_dir).resolve().name}:{pooling}"
+
+    def embed_query(self, query: str) -> list[float]:
+        encoding = self.tokenizer.encode(query)
+        inputs = {"input_ids": encoding.ids, "attention_mask": encoding.attention_mask,
+                  "token_type_ids": encoding.type_ids}
+        token_embeddings = self.session.run(None, {name: np.array([value], dtype=np.int64)
+                                                   for name, value in inputs.items() if name in self.input_names})[0]
+        # A single question isn't padded, so every token takes part in mean pooling.
+        vector = token_embeddings[0][0] if self.pooling == "cls" else token_embeddings[0].mean(axis=0)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    async def embed(self, query: str) -> list[float]:
+        return await asyncio.to_thread(self.embed_query, query)
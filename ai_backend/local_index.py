@@ -0,0 +1,73 @@
+import asyncio
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# The only fields lookup_faq reads, Azure AI Search searches select just these to keep the responses small.
+RESULT_FIELDS = ["content", "source", "original_content"]
+FILTER_FIELDS = ["park", "annual_employee", "seasonal_employee"]
+
+
+class LocalVectorIndex:
+    """
+    In-memory mirror of the Azure AI Search FAQ index.
+
+    The documents and their content vectors are paged out of Azure once and kept in a normalized numpy matrix, so a
+    query is an exact inner product search in memory instead of a network call. The mirror is reloaded periodically
+    by refresh_forever. search returns None until the mirror has been loaded, so callers can fall back to Azure.
+    """
+
+    def __init__(self, get_search_client, refresh_interval: float = 15 * 60):
+        self.get_search_client = get_search_client
+        self.refresh_interval = refresh_interval
+        self._index = None
+
+    def load(self):
+        results = self.get_search_client().search(search_text="*",
+                                                  select=RESULT_FIELDS + FILTER_FIELDS + ["contentVector"])
+        documents = [document for document in results if document.get("contentVector")]
+        if not documents:
+            logger.warning("No documents with content vectors found, the local index is not used.")
+            return
+
+        vectors = np.array([document["contentVector"] for document in documents], dtype=np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        # Swap in the whole index at once, so searches never see a half loaded mirror.
+        self._index = {
+            "vectors": vectors,
+            "parks": np.array([document["park"] for document in documents]),
+            "annual_employee": np.array([bool(document["annual_employee"]) for document in documents]),
+            "seasonal_employee": np.array([bool(document["seasonal_employee"]) for document in documents]),
+            "documents": [{field: document[field] for field in RESULT_FIELDS} for document in documents],
+        }
+        logger.info("Loaded %d documents into the local index.", len(documents))
+
+    async def refresh_forever(self):
+        while True:
+            try:
+                await asyncio.to_thread(self.load)
+            except Exception:
+                logger.exception("Failed to load the local index.")
+            await asyncio.sleep(self.refresh_interval)
+
+    def search(self, embedding: list[float], park: str, annual_employee: bool, seasonal_employee: bool,
+               k: int = 3) -> list[dict] | None:
+        index = self._index
+        if index is None:
+            return None
+
+        # Same filter as the one sent to Azure AI Search in hybrid_search.
+        mask = index["parks"] == park
+        if annual_employee or seasonal_employee:
+            mask &= ((index["annual_employee"] & annual_employee) | (index["seasonal_employee"] & seasonal_employee))
+        candidates = np.flatnonzero(mask)
+        query = np.asarray(embedding, dtype=np.float32)
+        # A mirror loaded from an index embedded with another model can't be compared with the query.
+        if candidates.size == 0 or query.shape[0] != index["vectors"].shape[1]:
+            return None
+
+        scores = index["vectors"][candidates] @ (query / np.linalg.norm(query))
+        best = candidates[np.argsort(-scores)[:k]]
+        return [index["documents"][i] for i in best]
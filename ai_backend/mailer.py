@@ -0,0 +1,55 @@
+import asyncio
+import logging
+import os
+
+import httpx
+from sendgrid.helpers.mail import Mail
+from tenacity import AsyncRetrying, retry_if_exception, stop_after_attempt, wait_exponential
+
+logger = logging.getLogger(__name__)
+
+SENDGRID_API_KEY = os.environ["SENDGRID_API_KEY"]
+
+# Shared by all email tools, so sends reuse pooled keep-alive connections to SendGrid.
+sendgrid_client = httpx.AsyncClient(base_url="https://api.sendgrid.com", timeout=httpx.Timeout(10.0),
+                                    headers={"Authorization": f"Bearer {SENDGRID_API_KEY}"},
+                                    limits=httpx.Limits(max_connections=20, max_keepalive_connections=10,
+                                                        keepalive_expiry=30))
+
+# Keeps a reference to the background sends, otherwise they can be garbage collected before they are done.
+_background_sends = set()
+
+
+def _is_transient(error: BaseException) -> bool:
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code == 429 or error.response.status_code >= 500
+    return isinstance(error, httpx.TransportError)
+
+
+async def send_mail(message: Mail):
+    """Sends the message with the SendGrid v3 API. Rate limits and server errors are retried, other errors raised."""
+    async for attempt in AsyncRetrying(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=0.5, max=4),
+                                       retry=retry_if_exception(_is_transient), reraise=True):
+        with attempt:
+            response = await sendgrid_client.post("/v3/mail/send", json=message.get())
+            response.raise_for_status()
+
+
+async def _send_and_log(message: Mail):
+    try:
+        await send_mail(message)
+    except Exception:
+        logger.exception("Failed to send email with subject %s", message.subject)
+
+
+def send_mail_in_background(message: Mail):
+    """Sends the message without waiting for it, failures are logged."""
+    task = asyncio.create_task(_send_and_log(message))
+    _background_sends.add(task)
+    task.add_done_callback(_background_sends.discard)
+
+
+async def close():
+    """Waits for background sends to finish and closes the SendGrid client."""
+    await asyncio.gather(*_background_sends, return_exceptions=True)
+    await sendgrid_client.aclose()
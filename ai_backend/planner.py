@@ -0,0 +1,102 @@
+import asyncio
+import json
+import logging
+import re
+import uuid
+
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+logger = logging.getLogger(__name__)
+
+PLANNER_PROMPT = """Du planerar verktygsanrop åt Backster, en AI-assistent för medarbetare på {park} med \
+anställningsformen {employmentType}. Dagens datum är {current_date}.
+Dela upp medarbetarens senaste fråga i de verktygsanrop som behövs för att svara. Tillgängliga verktyg:
+{tool_descriptions}
+
+Svara med JSON på formen {{"tasks": [{{"id": 1, "tool": "lookup_faq", "args": {{}}, "depends_on": []}}]}}.
+Ange i depends_on id för de uppgifter vars resultat behövs, och referera till resultatet med "$id" i args.
+Planera bara anrop där alla argument framgår av konversationen. Lämna annars tasks tom."""
+
+TASK_REFERENCE_RE = re.compile(r"\$(\d+)\b")
+
+
+class Planner:
+    """
+    Plans all tool calls for a user question with one LLM call and runs them as a DAG, in the style of LLMCompiler.
+
+    Tasks without pending dependencies run concurrently, wave by wave. The plan and its results are added to the
+    conversation as an AI message with tool calls followed by the tool messages, so the assistant can join them into
+    an answer with a single LLM call instead of one round trip per tool.
+    """
+
+    def __init__(self, runnable, tool_node, tools):
+        self.runnable = runnable
+        self.tool_node = tool_node
+        self.tool_names = {tool.name for tool in tools}
+        self.tool_descriptions = "\n".join(json.dumps(convert_to_openai_tool(tool)["function"], ensure_ascii=False)
+                                           for tool in tools)
+
+    async def __call__(self, state, config):
+        if not isinstance(state["messages"][-1], HumanMessage):
+            return {"messages": []}
+
+        configuration = config.get("configurable", {})
+        prompt = SystemMessage(content=PLANNER_PROMPT.format(park=configuration.get("park"),
+                                                             employmentType=configuration.get("employmentType"),
+                                                             current_date=configuration.get("current_date", ""),
+                                                             tool_descriptions=self.tool_descriptions))
+        response = await self.runnable.ainvoke([prompt] + state["messages"], config)
+        tasks = self._parse_tasks(response.content)
+        if not tasks:
+            return {"messages": []}
+
+        tool_calls, tool_messages = await self._execute(tasks, config)
+        return {"messages": [AIMessage(content="", tool_calls=tool_calls), *tool_messages],
+                **self.tool_node.faq_artifact(tool_messages)}
+
+    def _parse_tasks(self, content):
+        try:
+            tasks = json.loads(content)["tasks"]
+            return {str(task["id"]): {"tool": task["tool"],
+                                      "args": task.get("args", {}),
+                                      "depends_on": [str(dependency) for dependency in task.get("depends_on", [])]}
+                    # Tasks with arguments that aren't an object can't be called.
+                    for task in tasks if task["tool"] in self.tool_names and isinstance(task.get("args", {}), dict)}
+        except (ValueError, KeyError, TypeError):
+            logger.warning("Could not parse the plan %r, leaving the question to the assistant.", content)
+            return {}
+
+    @staticmethod
+    def _resolve_args(args, results):
+        """Replaces $id references in string arguments with the output of the task they refer to."""
+        resolved = {}
+        for name, value in args.items():
+            if isinstance(value, str):
+                # Matched as whole ids, so resolving $1 doesn't rewrite $10.
+                value = TASK_REFERENCE_RE.sub(lambda match: str(results[match.group(1)].content)
+                                              if match.group(1) in results else match.group(0), value)
+            resolved[name] = value
+        return resolved
+
+    async def _execute(self, tasks, config):
+        pending = dict(tasks)
+        results = {}
+        tool_calls = []
+        while pending:
+            ready = [task_id for task_id, task in pending.items()
+                     if all(dependency in results for dependency in task["depends_on"])]
+            if not ready:
+                logger.warning("Skipping tasks with unresolvable dependencies: %s", list(pending))
+                break
+
+            wave = [{"name": pending[task_id]["tool"],
+                     "args": self._resolve_args(pending[task_id]["args"], results),
+                     "id": f"call_{uuid.uuid4().hex}"} for task_id in ready]
+            messages = await asyncio.gather(*[self.tool_node.run_tool(tool_call, config) for tool_call in wave])
+            for task_id, tool_call, message in zip(ready, wave, messages):
+                results[task_id] = message
+                tool_calls.append(tool_call)
+                del pending[task_id]
+
+        return tool_calls, list(results.values())
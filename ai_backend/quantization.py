@@ -0,0 +1,25 @@
+import numpy as np
+
+INT8_MAX = 127
+
+
+def quantize(embedding) -> np.ndarray:
+    """
+    Quantizes the embedding to int8, a quarter of the size of float32. The vector is scaled so that its largest
+    component is INT8_MAX, which uses the whole int8 range. Only the direction is kept, which is all a cosine needs.
+    """
+    vector = np.asarray(embedding, dtype=np.float32)
+    return np.round(vector / np.abs(vector).max() * INT8_MAX).astype(np.int8)
+
+
+def norms(vectors: np.ndarray) -> np.ndarray:
+    return np.linalg.norm(vectors.astype(np.float32), axis=-1)
+
+
+def cosine_similarities(vectors: np.ndarray, vector_norms: np.ndarray, query: np.ndarray) -> np.ndarray:
+    """
+    Cosine similarities between rows of quantized vectors, with their norms, and a quantized query. The dot products
+    are computed in float32, which is exact for int8 vectors of up to 1024 dimensions and avoids overflowing int8.
+    """
+    query = query.astype(np.float32)
+    return (vectors.astype(np.float32) @ query) / (vector_norms * np.linalg.norm(query))
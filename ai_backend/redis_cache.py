@@ -0,0 +1,43 @@
+import hashlib
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class RedisEmbeddingCache:
+    """
+    Embedding cache in Redis, shared by all workers and kept across restarts.
+
+    Embeddings are stored as float32 bytes under a key namespaced by the embedding model, so a model change never
+    returns vectors of another model. Redis errors are logged and treated as cache misses, so an unavailable Redis
+    only costs the embedding calls it would have saved.
+    """
+
+    def __init__(self, url: str, namespace: str, ttl: int = 7 * 24 * 60 * 60):
+        from redis.asyncio import Redis
+
+        self.redis = Redis.from_url(url)
+        self.namespace = namespace
+        self.ttl = ttl
+
+    def _key(self, query: str) -> str:
+        return f"embedding:{self.namespace}:{hashlib.sha256(query.encode('utf-8')).hexdigest()}"
+
+    async def get(self, query: str) -> list[float] | None:
+        try:
+            value = await self.redis.get(self._key(query))
+        except Exception:
+            logger.warning("Could not read the embedding cache in Redis.", exc_info=True)
+            return None
+        return None if value is None else np.frombuffer(value, dtype=np.float32).tolist()
+
+    async def set(self, query: str, embedding: list[float]):
+        try:
+            await self.redis.setex(self._key(query), self.ttl, np.asarray(embedding, dtype=np.float32).tobytes())
+        except Exception:
+            logger.warning("Could not write the embedding cache in Redis.", exc_info=True)
+
+    async def close(self):
+        await self.redis.aclose()
@@ -0,0 +1,38 @@
+import asyncio
+import hashlib
+
+from ai_backend.ttl_cache import TTLCache
+
+
+def _digest(query: str, content: str) -> bytes:
+    return hashlib.blake2b(f"{query}\0{content}".encode("utf-8"), digest_size=8).digest()
+
+
+class CrossEncoderReranker:
+    """
+    Reranks search results with a cross-encoder that scores the query and each document together.
+
+    Scores are cached per query and document for ttl seconds, so repeated questions only pay for documents that
+    haven't been scored yet. The cache is keyed by a 64 bit digest of the pair, so it doesn't hold on to every
+    document text.
+    """
+
+    def __init__(self, model_name: str, ttl: float = 15 * 60):
+        from sentence_transformers import CrossEncoder
+
+        self.model = CrossEncoder(model_name)
+        self._scores = TTLCache(maxsize=4096, ttl=ttl)
+
+    async def rerank(self, query: str, results: list[dict], top: int) -> list[dict]:
+        keys = [_digest(query, result["content"]) for result in results]
+        contents = {key: result["content"] for key, result in zip(keys, results)}
+        scores = {key: self._scores.get(key) for key in keys}
+        missing = [key for key, score in scores.items() if score is None]
+        if missing:
+            predicted = await asyncio.to_thread(self.model.predict, [(query, contents[key]) for key in missing])
+            for key, score in zip(missing, predicted):
+                scores[key] = float(score)
+                self._scores.set(key, float(score))
+
+        ranked = sorted(zip(keys, results), key=lambda item: scores[item[0]], reverse=True)
+        return [result for _, result in ranked[:top]]
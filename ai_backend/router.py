@@ -0,0 +1,97 @@
+import re
+import uuid
+from datetime import date, timedelta
+
+from langchain_core.messages import AIMessage, HumanMessage
+from langgraph.graph import END
+
+PARKS = ("Gröna Lund", "Furuvik", "Kolmården", "Skara Sommarland")
+
+GREETING_RE = re.compile(r"^\s*(hej|hejsan|hallå|tja|tjena|god (morgon|dag|kväll)|hi|hello)\s*[!.]*\s*$",
+                         re.IGNORECASE)
+THANKS_RE = re.compile(r"^\s*(tack|tack så mycket|tusen tack|tackar)\s*[!.]*\s*$", re.IGNORECASE)
+PARK_NAME_RE = re.compile("|".join(re.escape(park) for park in PARKS), re.IGNORECASE)
+# The opening hours question has to be about the park itself, like "Har Kolmården öppet idag?" or "När stänger
+# parken imorgon?", and not about e.g. the staff restaurant.
+_PARK_SUBJECT = rf"(parken|vi|ni|{PARK_NAME_RE.pattern})"
+OPENING_HOURS_RE = re.compile(rf"\b(har|är) {_PARK_SUBJECT} öppet\b"
+                              rf"|\b(öppnar|stänger) {_PARK_SUBJECT}\b"
+                              rf"|\b{_PARK_SUBJECT} (öppnar|stänger)\b"
+                              rf"|\bparkens öppettider\b"
+                              rf"|\böppettider(na)? (för|i|på|har) {_PARK_SUBJECT}\b",
+                              re.IGNORECASE)
+# A question without a subject, like "Öppettider imorgon?" or "Är parken öppen idag?", is also about the park when it
+# has no other words than these besides the date and the park's name.
+OPENING_HOURS_WORDS = {"öppettider", "öppettiderna", "öppen", "öppet"}
+QUESTION_WORDS = {"vad", "vilka", "när", "hur", "är", "har", "ser", "ut", "blir", "det", "vi", "ni", "parken",
+                  "parkens"}
+ISO_DATE_RE = re.compile(r"\b(\d{4}-\d{2}-\d{2})\b")
+RELATIVE_DATE_RE = re.compile(r"\b(idag|i dag|ikväll|imorgon|i morgon|imorn|i övermorgon)\b", re.IGNORECASE)
+RELATIVE_DAYS = {"idag": 0, "i dag": 0, "ikväll": 0, "imorgon": 1, "i morgon": 1, "imorn": 1, "i övermorgon": 2}
+
+GREETING_ANSWER = "Hej! Jag är Backster. Vad kan jag hjälpa dig med idag?"
+THANKS_ANSWER = "Varsågod! Hör av dig om det är något mer jag kan hjälpa dig med."
+CANNED_ANSWERS = {GREETING_ANSWER, THANKS_ANSWER}
+
+
+def _requested_date(text: str, current_date: str) -> str | None:
+    iso_date = ISO_DATE_RE.search(text)
+    if iso_date:
+        try:
+            return date.fromisoformat(iso_date.group(1)).isoformat()
+        except ValueError:
+            # Left to the assistant, the park data API answers an invalid date as if the park was closed.
+            return None
+    relative_date = RELATIVE_DATE_RE.search(text)
+    if relative_date:
+        today = date.fromisoformat(current_date) if current_date else date.today()
+        return (today + timedelta(days=RELATIVE_DAYS[relative_date.group(1).lower()])).isoformat()
+    return None
+
+
+def _is_opening_hours_question(text: str) -> bool:
+    if OPENING_HOURS_RE.search(text):
+        return True
+    without_dates = RELATIVE_DATE_RE.sub(" ", ISO_DATE_RE.sub(" ", text))
+    words = set(re.findall(r"\w+", PARK_NAME_RE.sub(" ", without_dates).lower()))
+    return bool(words & OPENING_HOURS_WORDS) and words <= OPENING_HOURS_WORDS | QUESTION_WORDS
+
+
+def route_message(state, config):
+    """
+    Answers or dispatches trivial questions without calling the LLM.
+
+    Greetings and thanks get a canned answer, and questions about the opening hours of the employee's park on a specific
+    date are sent straight to get_daily_park_data. Everything else is left to the assistant, which is also the node
+    that phrases the answer from the park data.
+    """
+    message = state["messages"][-1]
+    if not isinstance(message, HumanMessage) or not isinstance(message.content, str):
+        return {"messages": []}
+    text = message.content
+    configuration = config.get("configurable", {})
+
+    if GREETING_RE.match(text):
+        return {"messages": [AIMessage(content=GREETING_ANSWER)]}
+    if THANKS_RE.match(text):
+        return {"messages": [AIMessage(content=THANKS_ANSWER)]}
+
+    park = configuration.get("park")
+    # Questions about another park than the employee's are left to the assistant, which picks the park from the text.
+    other_parks = {name.lower() for name in PARK_NAME_RE.findall(text)} - {str(park).lower()}
+    if park in PARKS and not other_parks and _is_opening_hours_question(text):
+        requested_date = _requested_date(text, configuration.get("current_date", ""))
+        if requested_date:
+            tool_call = {"name": "get_daily_park_data", "args": {"park": park, "date": requested_date},
+                         "id": f"call_{uuid.uuid4().hex}"}
+            return {"messages": [AIMessage(content="", tool_calls=[tool_call])]}
+
+    return {"messages": []}
+
+
+def route_condition(state):
+    """Continues to the tools or ends when the router answered, otherwise the assistant takes over."""
+    message = state["messages"][-1]
+    if isinstance(message, AIMessage):
+        return "tools" if message.tool_calls else END
+    return "assistant"
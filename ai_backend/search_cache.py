@@ -0,0 +1,64 @@
+import time
+
+import numpy as np
+
+from ai_backend.quantization import cosine_similarities, norms, quantize
+from ai_backend.ttl_cache import TTLCache
+
+
+class SearchResultCache:
+    """
+    Two tier in-memory cache of FAQ search results, namespaced by the search filter.
+
+    Identical queries are answered from an exact match cache before they are embedded. Other queries are compared
+    with the embeddings of earlier queries with the same filter, and a query with a cosine similarity of at least
+    min_similarity reuses their results. Entries expire after ttl seconds so that updated FAQ content is picked up.
+    Query embeddings are kept quantized to int8, which is precise enough to compare them.
+    """
+
+    def __init__(self, ttl: float = 15 * 60, min_similarity: float = 0.95, max_entries_per_filter: int = 256):
+        self.ttl = ttl
+        self.min_similarity = min_similarity
+        self.max_entries_per_filter = max_entries_per_filter
+        self._exact = TTLCache(maxsize=1024, ttl=ttl)
+        # Per filter: expiry stamps, a matrix of quantized query embeddings, their norms and the results of each query.
+        self._semantic = {}
+
+    def get(self, filter_key: tuple, query: str):
+        return self._exact.get((filter_key, query.strip().lower()))
+
+    def lookup(self, filter_key: tuple, embedding: list[float]):
+        entries = self._semantic.get(filter_key)
+        if entries is None:
+            return None
+        expires_at, vectors, vector_norms, results = entries
+        query = quantize(embedding)
+        if query.shape[0] != vectors.shape[1]:
+            return None
+
+        similarities = cosine_similarities(vectors, vector_norms, query)
+        similarities[expires_at <= time.monotonic()] = -1
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.min_similarity:
+            return None
+        return results[best]
+
+    def store(self, filter_key: tuple, query: str, embedding: list[float], results: list):
+        self._exact.set((filter_key, query.strip().lower()), results)
+
+        vector = quantize(embedding)
+        now = time.monotonic()
+        expires_at, vectors, vector_norms, cached_results = self._semantic.get(filter_key, (None, None, None, None))
+        if vectors is None or vectors.shape[1] != vector.shape[0]:
+            expires_at, vectors, vector_norms, cached_results = (np.empty(0), np.empty((0, vector.shape[0]), np.int8),
+                                                                 np.empty(0, np.float32), [])
+
+        # Expired entries are dropped, and the oldest ones when the filter has reached its limit.
+        live = np.flatnonzero(expires_at > now)
+        keep = live[max(0, len(live) - self.max_entries_per_filter + 1):]
+        self._semantic[filter_key] = (
+            np.append(expires_at[keep], now + self.ttl),
+            np.vstack([vectors[keep], vector]),
+            np.append(vector_norms[keep], norms(vector)),
+            [cached_results[i] for i in keep] + [results],
+        )
@@ -0,0 +1,109 @@
+import json
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from ai_backend.quantization import cosine_similarities, norms, quantize
+
+
+class SemanticCache:
+    """
+    SQLite backed cache of assistant answers, keyed by the embedding of the user question. The lookup_faq artifact the
+    answer is based on is stored with it, so a cached answer is shown with its sources.
+
+    Answers are namespaced per embedding model, park and employment type. Embeddings of different models can't be
+    compared, and the same question can have different answers depending on where and how the employee is employed. Entries older than ttl_seconds are
+    ignored on lookup and purged on insert so that updated FAQ content is picked up. Embeddings are stored quantized
+    to int8, a quarter of the size of float32.
+    """
+
+    def __init__(self, path: str, model: str, ttl_seconds: int = 24 * 60 * 60, max_distance: float = 0.1,
+                 max_entries_per_namespace: int = 1000):
+        self.path = path
+        self.model = model
+        self.ttl_seconds = ttl_seconds
+        self.max_distance = max_distance
+        self.max_entries_per_namespace = max_entries_per_namespace
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connection(self):
+        # Opened on first use, so importing the agent doesn't create the database file.
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS cache (
+                    key TEXT,
+                    embedding BLOB,
+                    response BLOB,
+                    artifact BLOB,
+                    park TEXT,
+                    employment TEXT,
+                    ts INTEGER,
+                    model TEXT
+                )
+            """)
+            # Caches created before artifacts and models were stored get the columns, their rows are never returned.
+            columns = {column[1] for column in conn.execute("PRAGMA table_info(cache)")}
+            if "artifact" not in columns:
+                conn.execute("ALTER TABLE cache ADD COLUMN artifact BLOB")
+            if "model" not in columns:
+                conn.execute("ALTER TABLE cache ADD COLUMN model TEXT")
+            conn.execute("CREATE INDEX IF NOT EXISTS cache_model_namespace ON cache (model, park, employment, ts)")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def lookup(self, embedding: list[float], park: str, employment: str) -> tuple[str, dict] | None:
+        """
+        Returns the cached answer closest to the embedding and its artifact, if its cosine distance is within
+        max_distance.
+        """
+        query = quantize(embedding)
+        with self._lock:
+            conn = self._connection()
+            # Only the embeddings are compared, the answer and artifact are read for the closest row alone.
+            rows = conn.execute(
+                # Rows stored as float32 before have another length and are skipped.
+                "SELECT rowid, embedding FROM cache WHERE model = ? AND park = ? AND employment = ? AND ts >= ? "
+                "AND length(embedding) = ? AND artifact IS NOT NULL",
+                (self.model, park, employment, int(time.time()) - self.ttl_seconds, query.nbytes)
+            ).fetchall()
+            if not rows:
+                return None
+
+            cached = np.stack([np.frombuffer(row[1], dtype=np.int8) for row in rows])
+            similarities = cosine_similarities(cached, norms(cached), query)
+            best = int(np.argmax(similarities))
+            if 1 - similarities[best] > self.max_distance:
+                return None
+            response, artifact = conn.execute("SELECT response, artifact FROM cache WHERE rowid = ?",
+                                              (rows[best][0],)).fetchone()
+        return response.decode("utf-8"), json.loads(artifact)
+
+    def store(self, key: str, embedding: list[float], response: str, artifact: dict, park: str, employment: str):
+        """
+        Stores the answer, replacing an earlier answer to the same question. Only the newest max_entries_per_namespace
+        answers of the model, park and employment type are kept.
+        """
+        key = " ".join(key.lower().split())
+        now = int(time.time())
+        with self._lock:
+            conn = self._connection()
+            conn.execute("DELETE FROM cache WHERE ts < ?", (now - self.ttl_seconds,))
+            conn.execute("DELETE FROM cache WHERE model = ? AND key = ? AND park = ? AND employment = ?",
+                         (self.model, key, park, employment))
+            conn.execute(
+                "INSERT INTO cache (key, embedding, response, artifact, park, employment, ts, model) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, quantize(embedding).tobytes(), response.encode("utf-8"),
+                 json.dumps(artifact, ensure_ascii=False).encode("utf-8"), park, employment, now, self.model)
+            )
+            conn.execute(
+                "DELETE FROM cache WHERE rowid IN (SELECT rowid FROM cache WHERE model = ? AND park = ? "
+                "AND employment = ? ORDER BY ts DESC, rowid DESC LIMIT -1 OFFSET ?)",
+                (self.model, park, employment, self.max_entries_per_namespace)
+            )
+            conn.commit()
@@ -95,7 +95,7 @@ function App() {
         setMessages(newMessages);
 
         try {
-            const response = await fetch(`/chat?token=${token}`, {
+            const response = await fetch(`/chat/stream?token=${token}`, {
                 method: "POST",
                 headers: {
                     "Content-Type": "application/json",
@@ -107,13 +107,40 @@ function App() {
                     employmentType: employmentType
                 }),
             });
+            if (!response.ok || !response.body) {
+                throw new Error(`Status ${response.status}`);
+            }
 
-            const data = await response.json();
-            setMessages([...newMessages, {fromBot: true, text: data.text}]);
-            setContents(data.contents);
-            setSources(data.sources);
-            console.log("Sources: ", data.sources);
-            console.log("Contents: ", data.contents);
+            // Svaret strömmas som server-sent events, token-händelser visas direkt och done avslutar svaret.
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = "";
+            let answer = "";
+            while (true) {
+                const {done, value} = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, {stream: true});
+                const events = buffer.split("\n\n");
+                buffer = events.pop() ?? "";
+                for (const event of events) {
+                    const lines = event.split("\n");
+                    const type = lines.find((line) => line.startsWith("event: "))?.slice(7);
+                    const data = JSON.parse(lines.find((line) => line.startsWith("data: "))?.slice(6) ?? "{}");
+                    if (type === "token") {
+                        answer += data.text;
+                        setIsTyping(false);
+                        setMessages([...newMessages, {fromBot: true, text: answer}]);
+                    } else if (type === "done") {
+                        setMessages([...newMessages, {fromBot: true, text: data.text}]);
+                        setContents(data.contents);
+                        setSources(data.sources);
+                        console.log("Sources: ", data.sources);
+                        console.log("Contents: ", data.contents);
+                    } else if (type === "error") {
+                        throw new Error("Backend kunde inte svara");
+                    }
+                }
+            }
         } catch (error) {
             console.error("Fel vid kommunikation med backend:", error);
         } finally {
@@ -1,20 +1,52 @@
 from fastapi import FastAPI, HTTPException, Depends, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, HTMLResponse
+from fastapi.responses import FileResponse, HTMLResponse, ORJSONResponse, StreamingResponse
 from fastapi.requests import Request
 from pydantic import BaseModel
 from dotenv import load_dotenv
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
+import asyncio
 import os
 import logging
-from jose import JWTError, jwt
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import AsyncExitStack, asynccontextmanager
+import orjson
+from jose import JWTError, jwk, jwt
 from datetime import datetime, timedelta
+from langchain_core.messages import AIMessage, AIMessageChunk
 load_dotenv()
 
-from ai_backend import agent
+from ai_backend import agent, agent_tools
 
-app = FastAPI()
+logger = logging.getLogger(__name__)
+
+DEFAULT_EXECUTOR_WORKERS = 32
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Blocking work like the semantic cache and the local index load runs in threads, allow more than the default
+    # of CPU count + 4 so concurrent requests don't queue behind each other on small containers.
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=DEFAULT_EXECUTOR_WORKERS))
+    async with AsyncExitStack() as stack:
+        checkpoint_dsn = os.getenv("POSTGRES_CHECKPOINT_DSN")
+        if checkpoint_dsn:
+            checkpointer = await stack.enter_async_context(agent.postgres_checkpointer(checkpoint_dsn))
+            agent.graph = agent.build_graph(agent.AGENT_MODE, checkpointer)
+
+        local_index_refresh = None
+        if agent_tools.local_index is not None:
+            local_index_refresh = asyncio.create_task(agent_tools.local_index.refresh_forever())
+        yield
+        if local_index_refresh is not None:
+            local_index_refresh.cancel()
+        await agent_tools.close_clients()
+
+
+# orjson serializes the answers, which can be several KB of markdown, a lot faster than the json module.
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -28,7 +60,10 @@ app.add_middleware(
 KEY = os.getenv("BACKEND_KEY")
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = "HS256"
+# Constructed once, jose would otherwise build the HMAC key from the secret on every encode and decode.
+SIGNING_KEY = jwk.construct(SECRET_KEY, ALGORITHM)
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+ACCESS_TOKEN_EXPIRE_SECONDS = ACCESS_TOKEN_EXPIRE_MINUTES * 60
 app.mount("/static", StaticFiles(directory="frontend/dist"), name="static")
 app.mount("/assets", StaticFiles(directory="frontend/dist/assets"), name="assets")
 
@@ -41,63 +76,128 @@ class MessageRequest(BaseModel):
     employmentType: str
 
 
-def verify_referer(request: Request):
-    """Make sure the request comes from a valid referer"""
-    if request.headers.get('Host') == "127.0.0.1:8000":
-        return
-    referer = request.headers.get('referer')
-    allowed_referers = ["https://backstage.prs.se", "https://app.actimo.com/"]
+ALLOWED_REFERERS = ("https://backstage.prs.se", "https://app.actimo.com/")
+# Paths that serve the frontend, they require the backend key and an allowed referer.
+FRONTEND_PATHS = {"/"}
+
 
-    if not referer or not any(referer.startswith(allowed) for allowed in allowed_referers):
-        raise HTTPException(status_code=403, detail="Not authenticated")
+def _is_authorized(request: Request) -> bool:
+    """Checks the backend key and makes sure the request comes from a valid referer"""
+    key = request.query_params.get("key")
+    if key is None or key != KEY:
+        return False
+    if request.headers.get("host") == "127.0.0.1:8000":
+        return True
+    # startswith with a tuple checks all allowed referers in one call.
+    return request.headers.get("referer", "").startswith(ALLOWED_REFERERS)
 
-def get_key(key: str = Query(...)):
-    if key != KEY:
-        raise HTTPException(status_code=403, detail="Not authenticated")
-    return key
+
+class FrontendAuthMiddleware:
+    """
+    Rejects unauthorized requests for the frontend before routing and dependency resolution. A plain ASGI middleware,
+    so other requests, like the streamed chat answers, pass through untouched.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] in FRONTEND_PATHS and not _is_authorized(Request(scope)):
+            response = ORJSONResponse(status_code=403, content={"detail": "Not authenticated"})
+            await response(scope, receive, send)
+            return
+        await self.app(scope, receive, send)
+
+
+app.add_middleware(FrontendAuthMiddleware)
 
 def create_access_token(data: dict, expires_delta: timedelta | None = None):
     to_encode = data.copy()
+    # exp is a NumericDate, seconds since the epoch in UTC.
     if expires_delta:
-        expire = datetime.now() + expires_delta
+        expire = int(time.time() + expires_delta.total_seconds())
     else:
-        expire = datetime.now() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+        expire = int(time.time()) + ACCESS_TOKEN_EXPIRE_SECONDS
     to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    encoded_jwt = jwt.encode(to_encode, SIGNING_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
 def validate_token(token: str = Query(...)):
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = jwt.decode(token, SIGNING_KEY, algorithms=[ALGORITHM])
         return payload
     except JWTError:
         raise HTTPException(status_code=403, detail="Invalid or expired token")
 @app.get("/")
-async def serve_frontend(request: Request, key: str = Depends(get_key), _: None = Depends(verify_referer)):
+async def serve_frontend(request: Request):
     token = create_access_token(data={"sub": "frontend_user", "date": datetime.now().strftime("%Y-%m-%d")})
     return templates.TemplateResponse("index.html", {"request": request, "token": token})
 
 
-@app.post("/chat")
-async def chat_with_agent(request: MessageRequest, token: str = Depends(validate_token)):
-    config = {"configurable": {
+def _chat_config(request: MessageRequest) -> dict:
+    return {"configurable": {
         "park": request.park,
         "employmentType": request.employmentType,
         "current_date": datetime.today().strftime("%Y-%m-%d"),
         "current_time": datetime.today().strftime("%H:%M"),
         "thread_id": request.session_id
     }}
+
+
+def _faq_references(state) -> tuple[list[str], list[str]]:
+    """Returns the sources and contents of the latest FAQ lookup, without duplicates and in ranking order."""
+    artifact = state.get("lookup_faq_artifact") or {}
+    # dict.fromkeys removes duplicates but keeps the search ranking, which the citations are shown in.
+    return (list(dict.fromkeys(artifact.get('sources', []))),
+            list(dict.fromkeys(artifact.get('original_contents', []))))
+
+
+@app.post("/chat")
+async def chat_with_agent(request: MessageRequest, token: str = Depends(validate_token)):
+    config = _chat_config(request)
     state = {"messages": [("user", request.query)]}
-    sources = []
-    original_contents = []
-    response = agent.graph.invoke(state, config)
+    response = await agent.graph.ainvoke(state, config)
     answer = response['messages'][-1].content
+    sources, original_contents = _faq_references(response)
+
+    return {'fromBot': True, "text": answer, "sources": sources, "contents": original_contents}
+
+
+# Nodes whose messages are answers to the employee, the planner's plan and tool results are not shown.
+STREAMED_NODES = {"router", "cache", "assistant"}
 
-    for message in response['messages']:
-        if message.name == "lookup_faq":
-            artifact = message.artifact
-            sources = artifact.get('sources', [])
-            original_contents = artifact.get('original_contents', [])
 
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {orjson.dumps(data).decode()}\n\n"
 
-    return {'fromBot': True, "text": answer, "sources": set(sources), "contents": set(original_contents)}
+
+async def _stream_answer(state, config):
+    final_state = None
+    try:
+        async for mode, chunk in agent.graph.astream(state, config, stream_mode=["messages", "values"]):
+            if mode == "values":
+                final_state = chunk
+                continue
+            message, metadata = chunk
+            if (metadata.get("langgraph_node") in STREAMED_NODES and isinstance(message, (AIMessage, AIMessageChunk))
+                    and isinstance(message.content, str) and message.content):
+                yield _sse("token", {"text": message.content})
+    except Exception:
+        logger.exception("Failed to stream the answer.")
+        yield _sse("error", {})
+        return
+
+    sources, original_contents = _faq_references(final_state)
+    yield _sse("done", {'fromBot': True, "text": final_state['messages'][-1].content, "sources": sources,
+                        "contents": original_contents})
+
+
+@app.post("/chat/stream")
+async def stream_chat_with_agent(request: MessageRequest, token: str = Depends(validate_token)):
+    """
+    Same as /chat, but streams the answer as server-sent events. token events carry the answer as it is generated,
+    and a final done event carries the complete answer with its sources.
+    """
+    state = {"messages": [("user", request.query)]}
+    return StreamingResponse(_stream_answer(state, _chat_config(request)), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
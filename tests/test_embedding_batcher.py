@@ -0,0 +1,90 @@
+import asyncio
+
+import pytest
+
+from ai_backend.embedding_batcher import EmbeddingBatcher
+
+
+class FakeEmbeddingsModel:
+    """Records the batches it is called with and embeds each query as its length."""
+
+    def __init__(self, error=None):
+        self.batches = []
+        self.error = error
+
+    async def aembed_documents(self, texts):
+        self.batches.append(list(texts))
+        if self.error is not None:
+            raise self.error
+        return [[float(len(text))] for text in texts]
+
+
+def make_batcher(model=None, **kwargs):
+    model = model or FakeEmbeddingsModel()
+    return EmbeddingBatcher(lambda: model, max_wait=0.05, **kwargs), model
+
+
+def embed_all(batcher, queries):
+    async def main():
+        return await asyncio.gather(*(batcher.embed(query) for query in queries), return_exceptions=True)
+
+    return asyncio.run(main())
+
+
+def test_concurrent_queries_are_embedded_in_one_call():
+    batcher, model = make_batcher()
+    assert embed_all(batcher, ["a", "bb", "ccc"]) == [[1.0], [2.0], [3.0]]
+    assert model.batches == [["a", "bb", "ccc"]]
+
+
+def test_batches_are_limited_to_max_batch_size():
+    batcher, model = make_batcher(max_batch_size=2)
+    embed_all(batcher, ["a", "bb", "ccc", "dddd", "eeeee"])
+    assert model.batches == [["a", "bb"], ["ccc", "dddd"], ["eeeee"]]
+
+
+def test_a_query_over_the_token_limit_starts_the_next_batch():
+    batcher, model = make_batcher(max_batch_tokens=5)
+    assert embed_all(batcher, ["aa", "bbb", "cccc", "d"]) == [[2.0], [3.0], [4.0], [1.0]]
+    assert model.batches == [["aa", "bbb"], ["cccc", "d"]]
+
+
+def test_an_error_is_raised_for_every_query_in_the_batch():
+    error = RuntimeError("API nere")
+    batcher, model = make_batcher(FakeEmbeddingsModel(error))
+    assert embed_all(batcher, ["a", "bb"]) == [error, error]
+    assert model.batches == [["a", "bb"]]
+
+
+def test_the_batcher_keeps_working_after_an_error():
+    model = FakeEmbeddingsModel(RuntimeError("API nere"))
+    batcher, _ = make_batcher(model)
+
+    async def main():
+        with pytest.raises(RuntimeError):
+            await batcher.embed("a")
+        model.error = None
+        return await batcher.embed("bb")
+
+    assert asyncio.run(main()) == [2.0]
+
+
+def test_repeated_queries_are_answered_from_the_cache():
+    batcher, model = make_batcher()
+    embed_all(batcher, ["Hur många semesterdagar?"])
+    assert embed_all(batcher, ["hur  många SEMESTERDAGAR?"]) == [[24.0]]
+    assert model.batches == [["Hur många semesterdagar?"]]
+
+
+def test_the_cache_keeps_the_latest_queries():
+    batcher, model = make_batcher(cache_size=1)
+    embed_all(batcher, ["a"])
+    embed_all(batcher, ["bb"])
+    embed_all(batcher, ["a"])
+    assert model.batches == [["a"], ["bb"], ["a"]]
+
+
+def test_identical_concurrent_queries_are_embedded_once():
+    batcher, model = make_batcher()
+    assert embed_all(batcher, ["Fråga", "fråga", "FRÅGA "]) == [[5.0], [5.0], [5.0]]
+    assert model.batches == [["Fråga"]]
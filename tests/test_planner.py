@@ -0,0 +1,117 @@
+import asyncio
+import json
+
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langchain_core.runnables import RunnableLambda
+from langchain_core.tools import tool
+
+from ai_backend.planner import Planner
+
+
+@tool
+def lookup_faq(query: str) -> str:
+    """Searches the FAQ."""
+    return ""
+
+
+@tool
+def get_daily_park_data(park: str, date: str) -> str:
+    """Fetches park data."""
+    return ""
+
+
+class FakeToolNode:
+    """Records the waves of tool calls and answers each call with its tool name and arguments."""
+
+    def __init__(self):
+        self.waves = []
+        self._current = None
+
+    async def run_tool(self, tool_call, config):
+        if self._current is None:
+            self._current = []
+            self.waves.append(self._current)
+            asyncio.get_running_loop().call_soon(self._end_wave)
+        self._current.append(tool_call)
+        return ToolMessage(content=f"{tool_call['name']}:{json.dumps(tool_call['args'], ensure_ascii=False)}",
+                           name=tool_call["name"], tool_call_id=tool_call["id"])
+
+    def _end_wave(self):
+        self._current = None
+
+    @staticmethod
+    def faq_artifact(tool_messages):
+        return {}
+
+
+def make_planner(plan):
+    content = plan if isinstance(plan, str) else json.dumps(plan)
+    tool_node = FakeToolNode()
+    planner = Planner(RunnableLambda(lambda messages: AIMessage(content=content)), tool_node,
+                      [lookup_faq, get_daily_park_data])
+    return planner, tool_node
+
+
+def run(planner, message="Fråga"):
+    return asyncio.run(planner({"messages": [HumanMessage(content=message)]}, {"configurable": {}}))
+
+
+def test_parse_tasks_drops_unknown_tools_and_args_that_are_not_objects():
+    planner, _ = make_planner("")
+    tasks = planner._parse_tasks(json.dumps({"tasks": [
+        {"id": 1, "tool": "lookup_faq", "args": {"query": "semester"}},
+        {"id": 2, "tool": "unknown", "args": {}},
+        {"id": 3, "tool": "lookup_faq", "args": "semester"},
+        {"id": 4, "tool": "get_daily_park_data", "args": {"park": "Furuvik", "date": "2024-06-01"},
+         "depends_on": [1]},
+    ]}))
+    assert tasks == {
+        "1": {"tool": "lookup_faq", "args": {"query": "semester"}, "depends_on": []},
+        "4": {"tool": "get_daily_park_data", "args": {"park": "Furuvik", "date": "2024-06-01"}, "depends_on": ["1"]},
+    }
+
+
+def test_parse_tasks_returns_no_tasks_for_invalid_plans():
+    planner, _ = make_planner("")
+    assert planner._parse_tasks("inte json") == {}
+    assert planner._parse_tasks(json.dumps({"plan": []})) == {}
+    assert planner._parse_tasks(json.dumps({"tasks": [{"tool": "lookup_faq"}]})) == {}
+
+
+def test_resolve_args_replaces_whole_task_references():
+    results = {"1": ToolMessage(content="ett", tool_call_id="a"), "10": ToolMessage(content="tio", tool_call_id="b")}
+    resolved = Planner._resolve_args({"query": "$1 och $10 och $3", "limit": 5}, results)
+    assert resolved == {"query": "ett och tio och $3", "limit": 5}
+
+
+def test_execute_runs_independent_tasks_in_one_wave_and_dependent_tasks_after():
+    planner, tool_node = make_planner({"tasks": [
+        {"id": 1, "tool": "lookup_faq", "args": {"query": "semester"}},
+        {"id": 2, "tool": "get_daily_park_data", "args": {"park": "Furuvik", "date": "2024-06-01"}},
+        {"id": 3, "tool": "lookup_faq", "args": {"query": "mer om $1"}, "depends_on": [1]},
+    ]})
+    result = run(planner)
+
+    assert [[tool_call["name"] for tool_call in wave] for wave in tool_node.waves] == [
+        ["lookup_faq", "get_daily_park_data"], ["lookup_faq"]]
+    assert tool_node.waves[1][0]["args"] == {"query": 'mer om lookup_faq:{"query": "semester"}'}
+    plan_message, *tool_messages = result["messages"]
+    assert [tool_call["id"] for tool_call in plan_message.tool_calls] == [message.tool_call_id
+                                                                          for message in tool_messages]
+
+
+def test_execute_skips_tasks_with_unresolvable_dependencies():
+    planner, tool_node = make_planner({"tasks": [
+        {"id": 1, "tool": "lookup_faq", "args": {"query": "semester"}},
+        {"id": 2, "tool": "lookup_faq", "args": {"query": "$9"}, "depends_on": [9]},
+    ]})
+    result = run(planner)
+
+    assert [len(wave) for wave in tool_node.waves] == [1]
+    assert [tool_call["args"] for tool_call in result["messages"][0].tool_calls] == [{"query": "semester"}]
+
+
+def test_planner_leaves_the_question_to_the_assistant_without_a_plan():
+    planner, tool_node = make_planner({"tasks": [{"id": 1, "tool": "lookup_faq", "args": "semester"}]})
+    assert run(planner) == {"messages": []}
+    assert tool_node.waves == []
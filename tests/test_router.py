@@ -0,0 +1,77 @@
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langgraph.graph import END
+
+from ai_backend.router import GREETING_ANSWER, THANKS_ANSWER, route_condition, route_message
+
+CONFIG = {"configurable": {"park": "Gröna Lund", "current_date": "2024-06-01"}}
+
+
+def route(text, config=CONFIG):
+    return route_message({"messages": [HumanMessage(content=text)]}, config)["messages"]
+
+
+def routed_park_data_args(text):
+    messages = route(text)
+    if not messages:
+        return None
+    tool_call, = messages[0].tool_calls
+    assert tool_call["name"] == "get_daily_park_data"
+    return tool_call["args"]
+
+
+@pytest.mark.parametrize("text", ["Hej", "hejsan!", "God morgon", "Hello."])
+def test_greetings_get_a_canned_answer(text):
+    assert route(text) == [AIMessage(content=GREETING_ANSWER)]
+
+
+@pytest.mark.parametrize("text", ["Tack", "tack så mycket!", "Tusen tack."])
+def test_thanks_get_a_canned_answer(text):
+    assert route(text) == [AIMessage(content=THANKS_ANSWER)]
+
+
+def test_a_greeting_with_a_question_is_left_to_the_assistant():
+    assert route("Hej, hur många semesterdagar har jag?") == []
+
+
+@pytest.mark.parametrize("text, date", [
+    ("Har parken öppet idag?", "2024-06-01"),
+    ("När stänger Gröna Lund i morgon?", "2024-06-02"),
+    ("När öppnar parken 2024-06-10?", "2024-06-10"),
+    ("Vad är parkens öppettider i övermorgon?", "2024-06-03"),
+    ("Har vi öppet imorgon?", "2024-06-02"),
+    ("Öppettider imorgon?", "2024-06-02"),
+    ("Är parken öppen idag?", "2024-06-01"),
+    ("Hur ser öppettiderna ut idag?", "2024-06-01"),
+])
+def test_opening_hours_questions_about_the_park_go_to_the_park_data(text, date):
+    assert routed_park_data_args(text) == {"park": "Gröna Lund", "date": date}
+
+
+@pytest.mark.parametrize("text", [
+    "Har Kolmården öppet idag?",
+    "När stänger personalrestaurangen idag?",
+    "Har personalrestaurangen öppet idag?",
+    "Öppettider för personalrestaurangen idag?",
+    "Har parken öppet?",
+    "Har ni öppet 2026-13-45?",
+    "Hur många semesterdagar har jag?",
+])
+def test_other_questions_are_left_to_the_assistant(text):
+    assert routed_park_data_args(text) is None
+
+
+def test_opening_hours_are_left_to_the_assistant_without_a_known_park():
+    assert route("Har parken öppet idag?", {"configurable": {"park": "Okänd park"}}) == []
+
+
+def test_route_condition():
+    tool_call = {"name": "get_daily_park_data", "args": {}, "id": "call_1"}
+    assert route_condition({"messages": [AIMessage(content="", tool_calls=[tool_call])]}) == "tools"
+    assert route_condition({"messages": [AIMessage(content=GREETING_ANSWER)]}) == END
+    assert route_condition({"messages": [HumanMessage(content="Fråga")]}) == "assistant"
+
+
+def test_only_the_latest_human_message_is_routed():
+    messages = [HumanMessage(content="Hej"), ToolMessage(content="", tool_call_id="call_1")]
+    assert route_message({"messages": messages}, CONFIG) == {"messages": []}